@@ -2,6 +2,9 @@ import os
 import glob
 import shutil
 
+# Molar gas constant [J K-1 mol-1], CODATA 2018 (exact)
+Rgas = 8.31446261815324
+
 # https://stackoverflow.com/a/5423147
 _ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),"../","../"))
 def get_gendir():
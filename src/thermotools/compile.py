@@ -0,0 +1,351 @@
+# Compilation of the generated tables into one netCDF file per species
+#    Metadata shared by all species (date, git hash, element masses and the
+#    JANAF name index) is resolved once, and species are then written
+#    independently, optionally across a pool of processes. All species can
+#    also be written to a single compressed archive, with a group for each.
+
+import os
+import glob
+import time
+import subprocess
+import numpy as np
+import netCDF4 as nc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from thermotools import get_gendir, moles, phase, store
+from thermotools.util import writesum
+from thermotools.janaf import T_ref, integrals as cp_integrals
+
+def get_datdir():
+    return os.path.join(get_gendir(), "compiled", "dat")
+
+# AGNI defaults
+default_gases = [
+    # (semi)refractory atoms
+    "Na", "Si", "Ti", "V", "Mg", "K", "Fe", "Li", "Ca", "Al", "Cr",
+    # ions
+    # "H-",
+    # rock vapours
+    "SiO2", "SiO", "SiH", "SiH2", "SiH4",
+    "FeO", "FeH",
+    "Mg2", "MgO",
+    "TiO", "TiO2", "VO", "CrH",
+    "CaO", "AlO", "Na2", "NaO", "NaOH", "KOH",
+    "HAlO2",
+    "H", "O", "C", "N", "S", "P", 
+    # Noble gases
+    "He", "Ne", "Ar", "Kr", "Xe",
+    # basic
+    "CH4", "CO2", "CO", "H2", "H2O", "O2", "OH", "O3",
+    # carbon
+    "H2O2", "C2H6", "C2H4","C2H2",  "CH3", "H2CO", "HO2", "C2", "C3", "C4", "C5",
+    "CH3CHO", "CH3OOH", "CH3COCH3", "CH3COCHO", "CHOCHO",
+    "C2H5CHO", "HOCH2CHO", "C2H5COCH3", "CH3ONO2", "C2H3", "C3H4", "C4H3",
+    "C2N2", "HCO",
+    # sulfur
+    "SO", "S2", "S3", "S6", "S8", "SO2", "SO3", "H2SO4", "H2S", "CS2", "OCS",
+    "CH3SH", "CH3S", "C2H6S", "C2H6S2",
+    # nitrogen
+    "N2", "HCN", "NH3",  "HNO3", "N2O5", "HONO", "HO2NO2",
+    "NO3", "N2O", "NO", "NO2", "N2O4", "N2H4", "N2O3", "CN",
+    # halogens and biosignatures
+    "HCl", "HF", "CH3Cl", "CH3F", "CH3Br", "SF6",
+    # phosphorous
+    "PH3", "PS", "PO", "PN"
+]
+
+# Species to compile
+#    The defaults, plus all gases in the phase database and any in the
+#    compiled cp directory. Sorted, without duplicates.
+def gas_list():
+    gases = list(default_gases)
+    gases.extend(list(phase.gases.keys()))
+
+    cp_files = glob.glob(os.path.join(get_gendir(), "compiled", "cp", "*.csv"))
+    gases.extend([os.path.splitext(os.path.basename(f))[0] for f in cp_files])
+
+    return sorted(set(gases))
+
+# Git hash of the repository, or an empty string if it cannot be found
+def git_hash():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(__file__))
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return out.stdout.strip()
+
+# Metadata shared by every species
+#    Plain dicts, so that it can be sent to worker processes.
+def metadata():
+    return {
+        "created" : int(time.strftime("%Y%m%d")),
+        "githash" : git_hash(),
+        "elements": dict(moles.read_elements()),
+        "janaf"   : dict(moles.janaf_index()),
+    }
+
+# Options for createVariable, for compression settings comp
+#    Chunks have at most comp["chunk"] elements along each dimension.
+#    No compression if comp is None.
+def _varopts(comp, shape):
+    if comp is None:
+        return {}
+    return {
+        "zlib"       : True,
+        "shuffle"    : True,
+        "complevel"  : comp["complevel"],
+        "chunksizes" : tuple(min(n, comp["chunk"]) for n in shape),
+    }
+
+# Write a 1D table as a dimension with a variable for each column
+def _write_1d(ds, dim:str, data, names, units, scale=None, comp=None):
+    ds.createDimension(dim, len(data[0]))
+    for i in range(len(names)):
+        var = ds.createVariable(names[i], "f8", dim, **_varopts(comp, (len(data[0]),)))
+        if (i > 0) and (scale is not None):
+            var[:] = data[i][:] * scale
+        else:
+            var[:] = data[i][:]
+        var.units = units[i]
+
+# Write a (T, log P) grid table as variables prefix_T, prefix_P, prefix_rho
+#    The density is chunked along both pressure and temperature.
+def _write_grid(ds, prefix:str, fpath:str, comp=None):
+    t, p, z = store.as_grid(store.read_table(fpath))
+
+    #    lookup temperatures
+    ds.createDimension(prefix+"_T", len(t))
+    var = ds.createVariable(prefix+"_T", "f8", prefix+"_T")
+    var[:] = t[:]
+    var.units = "K"
+    #    lookup pressures [log Pa]
+    ds.createDimension(prefix+"_P", len(p))
+    var = ds.createVariable(prefix+"_P", "f8", prefix+"_P")
+    var[:] = p[:]
+    var.units = "log10 Pa"
+    #    density [log kg m-3]
+    var = ds.createVariable(prefix+"_rho", "f8", (prefix+"_P", prefix+"_T"),
+                                **_varopts(comp, z.shape))
+    var[:] = z[:]
+    var.units = "log10 kg m-3"
+
+# JANAF name for a species, or an empty string if it has no JANAF data
+def _janaf(gas:str, meta:dict):
+    return meta["janaf"].get(moles.composition_key(gas), "")
+
+# Write the data for one species into a dataset or group
+#    Returns a list of notes on missing data.
+def _write_species(ds, gas:str, janaf:str, meta:dict, comp=None):
+    gendir = get_gendir()
+    notes = []
+
+    # MMW calculation
+    mmw_val = moles.mmw_from_formula(gas, meta["elements"])
+
+    # JANAF name
+    NC_janaf = ds.createVariable('JANAF', str)
+    NC_janaf[:] = np.array([janaf], dtype=object)
+
+    # Date created
+    NC_today = ds.createVariable('created', 'i8')
+    NC_today[:] = meta["created"]
+
+    # Git hash
+    NC_toolshash = ds.createVariable('ThermoTools_GitHash', str)
+    NC_toolshash[:] = np.array([meta["githash"]], dtype=object)
+
+    # MMW
+    NC_mmw = ds.createVariable("mmw","f8")
+    NC_mmw[:] = mmw_val
+    NC_mmw.units = "kg mol-1"
+
+    # Saturation curve
+    satdat = os.path.join(gendir, "sat", "dat")
+    sat_path = os.path.join(satdat, "%s_sat"%gas)
+    if store.exists(sat_path):
+        # Critical point
+        T_crit = float(store.read_table(os.path.join(satdat, "%s_crit"%gas))[0][0])
+        NC_tcrit = ds.createVariable("T_crit","f8")
+        NC_tcrit[:] = T_crit
+        NC_tcrit.units = "K"
+
+        # Triple point
+        T_trip = float(store.read_table(os.path.join(satdat, "%s_trip"%gas))[0][0])
+        NC_ttrip = ds.createVariable("T_trip","f8")
+        NC_ttrip[:] = T_trip
+        NC_ttrip.units = "K"
+
+        _write_1d(ds, "sat", store.read_table(sat_path),
+                    ("sat_T", "sat_P"), ("K", "log10 Pa"), comp=comp)
+    else:
+        notes.append("without saturation curve")
+
+    # Latent heat [J/kg]
+    lat_path = os.path.join(gendir, "lv", "dat", gas)
+    if store.exists(lat_path):
+        _write_1d(ds, "lat", store.read_table(lat_path),
+                    ("lat_T", "lat_H"), ("K", "J kg-1"), comp=comp)
+    else:
+        notes.append("without latent heat")
+
+    # Heat capacity, converted from "per mol" to "per kg", with the
+    #    enthalpy H - H(T_ref), entropy and Gibbs energy G - H(T_ref) on its grid
+    cap_path = os.path.join(gendir, "cp", "dat", janaf)
+    #    S is anchored to the tabulated entropy at T_ref, as written by the cp stage
+    cap = store.read_table(cap_path)
+    if len(cap) < 3:
+        raise Exception("No entropy in %s, re-run the cp stage"%cap_path)
+    cap_H, cap_S, cap_G = cp_integrals(cap[0], cap[1], float(np.interp(T_ref, cap[0], cap[2])))
+    _write_1d(ds, "cap", [cap[0], cap[1], cap_H, cap_S, cap_G],
+                ("cap_T", "cap_C", "cap_H", "cap_S", "cap_G"),
+                ("K", "J K-1 kg-1", "J kg-1", "J K-1 kg-1", "J kg-1"), scale=1.0/mmw_val, comp=comp)
+    ds.variables["cap_H"].T_ref = T_ref
+    ds.variables["cap_G"].T_ref = T_ref
+
+    # Van der Waals equation of state (density vs T,P)
+    vdw_path = os.path.join(gendir, "vdw", "dat", gas)
+    if store.exists(vdw_path):
+        _write_grid(ds, "vdw", vdw_path, comp=comp)
+    else:
+        notes.append("without VdW EOS")
+
+    # AQUA equation of state (density vs T,P)
+    if gas == "H2O":
+        fpath = os.path.join(gendir, "aqua", "dat", "H2O")
+        if store.exists(fpath):
+            _write_grid(ds, "aqua", fpath, comp=comp)
+        else:
+            notes.append("without AQUA EOS")
+
+    # CMS19 equation of state (density vs T,P)
+    if gas == "H2":
+        fpath = os.path.join(gendir, "cms19", "dat", "H2")
+        if store.exists(fpath):
+            _write_grid(ds, "cms19", fpath, comp=comp)
+        else:
+            notes.append("without CMS19 EOS")
+
+    return notes
+
+# Compile the netCDF file for one species
+#    Returns a list of notes on missing data, or None if the species was
+#    skipped because it has no JANAF data.
+def compile_gas(gas:str, meta:dict, datdir:str=None):
+    if datdir is None:
+        datdir = get_datdir()
+
+    # JANAF alias
+    janaf = _janaf(gas, meta)
+    if len(janaf) == 0:
+        return None
+
+    # create dataset
+    ncpath = os.path.join(datdir, "%s.nc"%gas)
+    if os.path.exists(ncpath):
+        os.remove(ncpath)
+    ds = nc.Dataset(ncpath, 'w')
+    notes = _write_species(ds, gas, janaf, meta)
+
+    # done with netcdf
+    ds.close()
+
+    # create checksum file
+    writesum(ncpath)
+
+    return notes
+
+# Compile one species, returning its name, notes and the time taken [s]
+def _compile_timed(gas:str, meta:dict, datdir:str):
+    t0 = time.perf_counter()
+    notes = compile_gas(gas, meta, datdir)
+    return gas, notes, time.perf_counter() - t0
+
+def _report(i:int, n:int, result):
+    gas, notes, dt = result
+    if notes is None:
+        print("    %s (%d/%d): skipping (no JANAF data)"%(gas, i+1, n))
+        return
+    print("    %s (%d/%d): %.2f s"%(gas, i+1, n, dt))
+    for s in notes:
+        print("        "+s)
+
+# Compile all species, across nproc processes
+#    Returns a dict of the time taken for each species which was written.
+#    The shared metadata is resolved here unless it is given.
+def compile_all(gases:list, datdir:str=None, nproc:int=1, meta:dict=None):
+    if datdir is None:
+        datdir = get_datdir()
+    os.makedirs(datdir, exist_ok=True)
+
+    if meta is None:
+        meta = metadata()
+    n = len(gases)
+    timing = {}
+    t0 = time.perf_counter()
+
+    print("Compiling %d species with %d processes"%(n, nproc))
+    if nproc > 1:
+        with ProcessPoolExecutor(nproc) as ex:
+            futures = [ex.submit(_compile_timed, g, meta, datdir) for g in gases]
+            for i, fut in enumerate(as_completed(futures)):
+                res = fut.result()
+                _report(i, n, res)
+                if res[1] is not None:
+                    timing[res[0]] = res[2]
+    else:
+        for i, g in enumerate(gases):
+            res = _compile_timed(g, meta, datdir)
+            _report(i, n, res)
+            if res[1] is not None:
+                timing[res[0]] = res[2]
+
+    print("Compiled %d species in %.2f s"%(len(timing), time.perf_counter() - t0))
+    return timing
+
+# Compile all species into a single netCDF file, with a group per species
+#    Variables within each group are the same as in the per-species files,
+#    compressed with zlib and shuffle in chunks of at most chunk elements
+#    along each dimension, so a single curve or slab can be read without
+#    decompressing the rest of the file. The root holds the list of species
+#    in the variable 'species', alongside the shared metadata.
+def compile_archive(gases:list, fpath:str=None, complevel:int=4, chunk:int=256,
+                        meta:dict=None):
+    if fpath is None:
+        fpath = os.path.join(get_gendir(), "compiled", "gases.nc")
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+
+    if meta is None:
+        meta = metadata()
+    comp = {"complevel":complevel, "chunk":chunk}
+    t0 = time.perf_counter()
+
+    if os.path.exists(fpath):
+        os.remove(fpath)
+    ds = nc.Dataset(fpath, 'w')
+
+    print("Writing archive of %d species to %s"%(len(gases), fpath))
+    names = []
+    for gas in sorted(gases):
+        janaf = _janaf(gas, meta)
+        if len(janaf) == 0:
+            continue
+        _write_species(ds.createGroup(gas), gas, janaf, meta, comp=comp)
+        names.append(gas)
+
+    # index of species
+    ds.createDimension("species", len(names))
+    NC_species = ds.createVariable("species", str, "species")
+    NC_species[:] = np.array(names, dtype=object)
+
+    NC_today = ds.createVariable('created', 'i8')
+    NC_today[:] = meta["created"]
+
+    NC_toolshash = ds.createVariable('ThermoTools_GitHash', str)
+    NC_toolshash[:] = np.array([meta["githash"]], dtype=object)
+
+    ds.close()
+    writesum(fpath)
+
+    print("Wrote %d species in %.2f s"%(len(names), time.perf_counter() - t0))
+    return fpath
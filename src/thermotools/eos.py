@@ -0,0 +1,283 @@
+# Regridding of tabulated equations of state onto (T, log P) grids
+#    Raw tables are given as lists of (T, log P, log rho) points. The AQUA
+#    table is treated as scattered data, for which a Delaunay triangulation
+#    is built once and cached on disk. The CMS19 table is already structured
+#    in (log T, log P), so it is interpolated on its native grid directly.
+
+import os
+import json
+import hashlib
+import shutil
+import pickle
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial import Delaunay
+from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator, RegularGridInterpolator
+
+from thermotools import get_gendir
+from thermotools.util import checksum
+
+def get_cachedir():
+    return os.path.join(get_gendir(), "eos", "cache")
+
+# Raw table formats
+#    cols   : columns of the file to read, in output order
+#    names  : names of the output columns
+#    log    : whether to take log10 of each column
+#    offset : added to each column after the log, for unit conversion
+#    tlog   : whether the temperature column is log10 T
+raw_formats = {
+    # P [Pa], T [K], rho [kg/m^3], ...
+    "aqua"  : {"skiprows":19, "cols":(1,0,2), "names":("tmp","prs","rho"),
+                "log":(False,True,True), "offset":(0.0,0.0,0.0), "tlog":False},
+    # log T [K], log P [GPa], log rho [g/cm^3], ...
+    "cms19" : {"skiprows":0,  "cols":(0,1,2), "names":("lgt","prs","rho"),
+                "log":(False,False,False), "offset":(0.0,9.0,3.0), "tlog":True},
+}
+
+# Read chunks of a raw table, converted and filtered to the window
+#    Each chunk has the output columns along axis 1.
+def _read_chunks(raw_file:str, fmt:dict, window, chunk:int):
+    with open(raw_file, 'r') as hdl:
+        for _ in range(fmt["skiprows"]):
+            hdl.readline()
+
+        while True:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                data = np.loadtxt(hdl, usecols=fmt["cols"], max_rows=chunk, ndmin=2)
+            if len(data) == 0:
+                break
+            nread = len(data)
+
+            # convert in place
+            for j in range(data.shape[1]):
+                if fmt["log"][j]:
+                    np.log10(data[:,j], out=data[:,j])
+                if fmt["offset"][j] != 0.0:
+                    data[:,j] += fmt["offset"][j]
+
+            if window is not None:
+                tmin, tmax, pmin, pmax = window
+                if fmt["tlog"]:
+                    tmin, tmax = np.log10(tmin), np.log10(tmax)
+                t, p = data[:,0], data[:,1]
+                data = data[(t >= tmin) & (t <= tmax) & (p >= pmin) & (p <= pmax)]
+
+            yield data
+            if nread < chunk:
+                break
+
+# Read a raw EOS table, in chunks of rows
+#    fmt is a key of raw_formats. The columns are returned as a dict with
+#    T [K] (or log T), log P [Pa] and log rho [kg/m^3]. If window is given as
+#    (tmin, tmax, pmin, pmax), with T in K and P in log Pa, only the points
+#    inside it are kept. The columns are written to a binary cache, keyed by
+#    the checksum of the file, the format and the window, which later calls
+#    memory-map instead of parsing the file again.
+def read_raw(raw_file:str, fmt:str, window=None, chunk:int=500000, cache:bool=True):
+    if fmt not in raw_formats:
+        raise Exception("Unknown raw table format %s"%fmt)
+    spec = raw_formats[fmt]
+    names = spec["names"]
+
+    if not cache:
+        data = np.concatenate(list(_read_chunks(raw_file, spec, window, chunk)))
+        return {n:np.ascontiguousarray(data[:,j]) for j,n in enumerate(names)}
+
+    key = "%s_%s"%(checksum(raw_file), fmt)
+    if window is not None:
+        key += "_" + "_".join("%g"%w for w in window)
+    cdir = os.path.join(get_cachedir(), key)
+    meta = os.path.join(cdir, "raw.json")
+
+    if not os.path.exists(meta):
+        print("    reading %s"%raw_file)
+        part = cdir + ".part"
+        if os.path.exists(part):
+            shutil.rmtree(part)
+        os.makedirs(part)
+
+        # stream the converted columns to disk
+        n = 0
+        hdls = [open(os.path.join(part, "%s.bin"%name), 'wb') for name in names]
+        try:
+            for data in _read_chunks(raw_file, spec, window, chunk):
+                for j,hdl in enumerate(hdls):
+                    np.ascontiguousarray(data[:,j]).tofile(hdl)
+                n += len(data)
+        finally:
+            for hdl in hdls:
+                hdl.close()
+
+        with open(os.path.join(part, "raw.json"), 'w') as hdl:
+            json.dump({"file":raw_file, "format":fmt, "window":window, "n":n}, hdl, indent=1)
+        if os.path.exists(cdir):
+            shutil.rmtree(cdir)
+        os.replace(part, cdir)
+    else:
+        print("    using cached table %s"%cdir)
+
+    with open(meta, 'r') as hdl:
+        n = json.load(hdl)["n"]
+    if n == 0:
+        raise Exception("No points of %s inside window %s"%(raw_file, str(window)))
+    return {name:np.memmap(os.path.join(cdir, "%s.bin"%name), dtype=float, mode='r', shape=(n,))
+                for name in names}
+
+# Offset and scale which normalise points to unit range
+#    Same as griddata(..., rescale=True), so results are unchanged
+def _rescale(points):
+    offset = np.mean(points, axis=0)
+    scale = np.ptp(points - offset, axis=0)
+    scale[~(scale > 0)] = 1.0
+    return offset, scale
+
+# Delaunay triangulation of the raw (T, log P) points
+#    If cache is True, the triangulation is cached on disk, keyed by a
+#    hash of the points themselves, so it is rebuilt whenever the raw file or
+#    the window read from it (see read_raw) changes.
+def triangulate(tmp_raw, prs_raw, cache:bool=True):
+    points = np.column_stack((tmp_raw, prs_raw))
+    offset, scale = _rescale(points)
+
+    fpath = None
+    if cache:
+        key = "tri_%s_%d"%(hashlib.blake2b(memoryview(points)).hexdigest(), len(points))
+        fpath = os.path.join(get_cachedir(), key + ".pkl")
+        if os.path.exists(fpath):
+            print("    using cached triangulation %s"%fpath)
+            with open(fpath, 'rb') as hdl:
+                return pickle.load(hdl)
+
+    print("    building triangulation of %d points"%len(points))
+    out = (Delaunay((points - offset) / scale), offset, scale)
+
+    if fpath is not None:
+        os.makedirs(get_cachedir(), exist_ok=True)
+        with open(fpath, 'wb') as hdl:
+            pickle.dump(out, hdl, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return out
+
+# Interpolator held by each worker process
+_worker = {}
+
+def _init_worker(itp):
+    _worker["itp"] = itp
+
+def _eval_chunk(xi):
+    return _worker["itp"](xi)
+
+# Evaluate interpolator at points xi, in chunks across nproc processes
+def _evaluate(itp, xi, nproc:int, chunk:int):
+    chunks = [xi[i:i+chunk] for i in range(0, len(xi), chunk)]
+    if nproc > 1:
+        with ProcessPoolExecutor(nproc, initializer=_init_worker, initargs=(itp,)) as ex:
+            out = list(ex.map(_eval_chunk, chunks))
+    else:
+        out = [itp(c) for c in chunks]
+    return np.concatenate(out)
+
+# Regrid scattered data onto the grid t_eval x p_eval
+#    Equivalent to griddata((tmp_raw,prs_raw), rho_raw, (ti,pi), rescale=True)
+#    over the points given, for method 'linear' or 'cubic'. If they are a
+#    window of the raw table (see read_raw), the triangulation near the edges
+#    of the window differs from that of the full table, so results there
+#    differ from griddata over the full table. Returns the meshgrid ti, pi and the
+#    interpolated values zi, each with shape (len(p_eval), len(t_eval)).
+#    cache is passed on to triangulate.
+def regrid(tmp_raw, prs_raw, rho_raw, t_eval, p_eval, method='linear',
+                cache:bool=True, nproc:int=1, chunk:int=200000):
+
+    tri, offset, scale = triangulate(tmp_raw, prs_raw, cache=cache)
+
+    match method:
+        case 'linear':
+            itp = LinearNDInterpolator(tri, rho_raw)
+        case 'cubic':
+            itp = CloughTocher2DInterpolator(tri, rho_raw)
+        case _:
+            raise Exception("Unknown interpolation method %s"%method)
+
+    ti,pi = np.meshgrid(t_eval, p_eval)
+    xi = (np.column_stack((ti.ravel(), pi.ravel())) - offset) / scale
+    zi = _evaluate(itp, xi, nproc, chunk).reshape(ti.shape)
+
+    return ti, pi, zi
+
+# Regrid data which is structured in (log T, log P) onto t_eval x p_eval
+#    The raw rows may be in any order, but must cover every combination of
+#    the unique log T and log P values. Points outside the table are NaN.
+def regrid_structured(lgt_raw, prs_raw, rho_raw, t_eval, p_eval, method='cubic',
+                        nproc:int=1, chunk:int=200000):
+
+    lgt = np.unique(lgt_raw)
+    prs = np.unique(prs_raw)
+    if len(lgt) * len(prs) != len(rho_raw):
+        raise Exception("Table is not structured in (log T, log P)")
+
+    order = np.lexsort((prs_raw, lgt_raw))
+    grid = np.reshape(rho_raw[order], (len(lgt), len(prs)))
+    itp = RegularGridInterpolator((lgt, prs), grid, method=method,
+                                    bounds_error=False, fill_value=np.nan)
+
+    ti,pi = np.meshgrid(t_eval, p_eval)
+    xi = np.column_stack((np.log10(ti.ravel()), pi.ravel()))
+    zi = _evaluate(itp, xi, nproc, chunk).reshape(ti.shape)
+
+    return ti, pi, zi
+
+# Enforce density increasing with pressure on a (P, T) grid
+#    Pressure is along axis 0 of z. Modes:
+#       'hold'   : a value lower than the previous (corrected) value or higher
+#                  than the next value takes the previous value; the first
+#                  and last pressure rows are unchanged
+#       'cummax' : each value is replaced by the running maximum in pressure
+#    NaN values are left in place. If correction is True, also returns the
+#    per-cell correction (10**z - 10**z_mono)/10**z_mono in percent.
+def make_monotonic(z, mode='hold', correction=False):
+    z = np.asarray(z, dtype=float)
+    n = z.shape[0]
+    out = z.copy()
+
+    # work on (P, everything else) views
+    z2 = z.reshape(n, -1)
+    o2 = out.reshape(n, -1)
+
+    match mode:
+        case 'hold':
+            if n > 2:
+                # Each row takes its own value where it is no higher than the
+                # next row, otherwise the previous row's, so the result is a
+                # running maximum over the values which are kept.
+                o2[1:-1][z2[1:-1] > z2[2:]] = -np.inf
+                o2[:-1] = np.maximum.accumulate(o2[:-1], axis=0)
+
+                # NaN interrupts the running maximum, so step through the
+                # pressure rows for columns which contain NaN
+                bad = np.any(np.isnan(z2), axis=0)
+                if np.any(bad):
+                    ob = z2[:, bad].copy()
+                    for j in range(1, n-1):
+                        hold = (ob[j] < ob[j-1]) | (ob[j] > ob[j+1])
+                        ob[j] = np.where(hold, ob[j-1], ob[j])
+                    o2[:, bad] = ob
+
+        case 'cummax':
+            o2[:] = np.fmax.accumulate(z2, axis=0)
+            o2[np.isnan(z2)] = np.nan
+
+        case _:
+            raise Exception("Unknown monotonicity mode %s"%mode)
+
+    if not correction:
+        return out
+
+    # evaluated in place in a single array
+    corr = np.subtract(z, out)
+    np.power(10.0, corr, out=corr)
+    corr -= 1.0
+    corr *= 100.0
+    return out, corr
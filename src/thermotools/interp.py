@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from scipy.interpolate import PchipInterpolator
+
+# Registry of memoized interpolators, shared between modules
+#    Bounded LRU: the least recently used entries are dropped once it holds
+#    more than maxsize, so tables from rebuilt or evicted query species, and
+#    from files which have changed, are freed.
+maxsize = 256
+_registry = OrderedDict()
+_lock = threading.Lock()
+
+# Return the object stored under key, building it on first access
+def memoize(key, build):
+    with _lock:
+        if key in _registry:
+            _registry.move_to_end(key)
+            return _registry[key]
+    value = build()
+    with _lock:
+        _registry[key] = value
+        while len(_registry) > maxsize:
+            _registry.popitem(last=False)
+    return value
+
+# Return the object built from table, memoized on the identity of table
+#    The entry keeps a reference to the table, and is only used if it holds
+#    this same table, so an id reused after the table was freed never hits.
+def memoize_table(name:str, table, build):
+    key = (name, id(table))
+    entry = memoize(key, lambda: (table, build()))
+    if entry[0] is not table:
+        entry = (table, build())
+        with _lock:
+            _registry[key] = entry
+    return entry[1]
+
+# Pchip interpolator for a table with rows [x, y]
+def pchip(table):
+    return memoize_table("pchip", table, lambda: PchipInterpolator(table[0], table[1]))
+
+# Gauss-Legendre nodes and weights, mapped onto the unit interval
+_gl_x, _gl_w = np.polynomial.legendre.leggauss(8)
+_gl_x = 0.5 * (_gl_x + 1.0)
+_gl_w = 0.5 * _gl_w
+
+# integrate f from a to b, elementwise over arrays of limits
+def gauss(f, a, b):
+    h = b - a
+    x = a[...,None] + h[...,None] * _gl_x
+    return h * np.sum(f(x) * _gl_w, axis=-1)
+
+# Drop all cached entries
+def clear():
+    with _lock:
+        _registry.clear()
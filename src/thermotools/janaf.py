@@ -0,0 +1,175 @@
+# Heat capacities from the JANAF tables
+#    The downloaded tables have a line with the source URL, a title line, a
+#    line of column names, and then tab-separated rows of T [K], Cp, S, ...
+#    Some cells are blank or hold text (e.g. INFINITE), and some rows are
+#    cut short. Each table is interpolated with a Pchip and sampled onto a
+#    grid between tmin and tmax, which is written to generated/cp/dat along
+#    with the entropy, anchored to the tabulated value at T_ref.
+
+import os
+import time
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.interpolate import PchipInterpolator
+
+from thermotools import get_gendir
+from thermotools import interp, store, sample
+
+header_rows = 3
+
+# Reference temperature for the enthalpy [K]
+T_ref = 298.15
+
+# Drop the count from single atoms in a JANAF formula (e.g. H2O1 -> H2O)
+def convert_name(name:str):
+    gas = name[0]+""
+    for i in range(1,len(name)):
+        if (name[i] == "1") and (name[i-1].isalpha()):
+            continue
+        gas += name[i]
+    return gas
+
+# Gas formula for a downloaded table
+def gas_from_path(fpath:str):
+    return convert_name(os.path.basename(fpath).split(".")[0])
+
+# Read a downloaded table
+#    Returns T [K], Cp and S [J mol-1 K-1], and -(G - H(T_ref))/T
+#    [J mol-1 K-1]. Cells which are blank or not numbers are read as NaN, and
+#    rows without both T and Cp are dropped. Rows are sorted by T, keeping the
+#    first row for a repeated T, since the interpolator needs T to be
+#    strictly increasing.
+def read_txt(fpath:str):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        data = np.genfromtxt(fpath, delimiter="\t", skip_header=header_rows, usecols=(0,1,2,3),
+                                dtype=float, missing_values="", filling_values=np.nan,
+                                invalid_raise=False, ndmin=2)
+    if data.shape[1] != 4:
+        raise Exception("No rows of Cp in %s"%fpath)
+    data = data[np.all(np.isfinite(data[:,:2]), axis=1)]
+
+    t, i = np.unique(data[:,0], return_index=True)
+    if len(t) < 2:
+        raise Exception("Too few rows of Cp in %s"%fpath)
+    return t, data[i,1], data[i,2], data[i,3]
+
+# Tabulated entropy at t_ref [J mol-1 K-1], interpolated between rows
+def entropy_ref(t, s, t_ref:float=T_ref):
+    ok = np.isfinite(s)
+    if (not np.any(ok)) or (t_ref < t[ok][0]) or (t_ref > t[ok][-1]):
+        raise Exception("No tabulated entropy at %g K"%t_ref)
+    return float(np.interp(t_ref, t[ok], s[ok]))
+
+# Parse a downloaded table and write the sampled Cp and S to outdir
+#    S is anchored to the tabulated entropy at T_ref, see integrals.
+#    Returns the gas, the path written and the grid information.
+def parse_txt(inpath:str, outdir:str, tmin:float, tmax:float, dt:float,
+                grid:str="uniform", tol:float=1e-4):
+    gas = gas_from_path(inpath)
+    t_data, c_data, s_data, _ = read_txt(inpath)
+
+    # interpolate data, and sample interpolated values
+    itp = PchipInterpolator(t_data, c_data)
+    t_out, c_out, info = sample.tabulate(itp, np.arange(tmin, tmax, dt), mode=grid,
+                                            tol=tol, scale="rel", breaks=t_data)
+    s_out = integrals(t_out, c_out, entropy_ref(t_data, s_data))[1]
+
+    outpath = os.path.join(outdir, gas)
+    store.write_table(outpath, [t_out, c_out, s_out],
+                        header="T [K] , Cp [J mol-1 K-1] , S [J mol-1 K-1]")
+    return gas, outpath, info
+
+def _parse_safe(inpath:str, *args):
+    try:
+        return inpath, parse_txt(inpath, *args), None
+    except Exception as e:
+        return inpath, None, str(e)
+
+# Parse all downloaded tables, across nproc processes
+#    Returns a dict with the path written and the grid information for each
+#    gas. Tables which cannot be read are reported and skipped.
+def parse_all(files:list, outdir:str=None, tmin:float=0.5, tmax:float=4500.0, dt:float=0.1,
+                grid:str="uniform", tol:float=1e-4, nproc:int=1):
+    if outdir is None:
+        outdir = os.path.join(get_gendir(), "cp", "dat")
+    os.makedirs(outdir, exist_ok=True)
+
+    files = sorted(files)
+    args = (outdir, tmin, tmax, dt, grid, tol)
+    t0 = time.perf_counter()
+
+    print("Parsing %d tables with %d processes"%(len(files), nproc))
+    if nproc > 1:
+        with ProcessPoolExecutor(nproc) as ex:
+            futures = [ex.submit(_parse_safe, f, *args) for f in files]
+            results = [fut.result() for fut in as_completed(futures)]
+    else:
+        results = [_parse_safe(f, *args) for f in files]
+
+    out = {}
+    for inpath, res, err in sorted(results, key=lambda r: r[0]):
+        if res is None:
+            print("    %s: skipping (%s)"%(inpath, err))
+            continue
+        gas, outpath, info = res
+        out[gas] = {"path":outpath, "info":info}
+
+    print("Parsed %d tables in %.2f s"%(len(out), time.perf_counter() - t0))
+    return out
+
+# Enthalpy, entropy and Gibbs free energy from Cp on the grid t
+#    H(T) - H(T_ref) is the antiderivative of the Pchip through (t, c).
+#    S(T) = s_ref + the integral of Cp/T from T_ref, accumulated over the
+#    segments by Gauss-Legendre quadrature, where s_ref is the tabulated
+#    (third-law) entropy at T_ref; integrating from the T = 0 row of the
+#    JANAF tables instead misses the entropy which the Pchip of Cp does not
+#    resolve at low T. G(T) - H(T_ref) = H - T S. Units follow c, so per mol
+#    for the tables in generated/cp/dat.
+def integrals(t, c, s_ref:float, t_ref:float=T_ref):
+    t = np.asarray(t, dtype=float)
+    itp = PchipInterpolator(t, np.asarray(c, dtype=float))
+
+    anti = itp.antiderivative()
+    h = anti(t) - anti(t_ref)
+
+    def integrand(x):
+        return itp(x) / x
+
+    cum = np.zeros(len(t))
+    cum[1:] = np.cumsum(interp.gauss(integrand, t[:-1], t[1:]))
+    k = int(np.clip(np.searchsorted(t, t_ref, side='right') - 1, 0, len(t)-2))
+    cum_ref = cum[k] + interp.gauss(integrand, t[k:k+1], np.array([t_ref]))[0]
+    s = s_ref + (cum - cum_ref)
+
+    g = h - t * s
+    return h, s, g
+
+# Plot the sampled Cp of a gas
+def plot_gas(fpath:str, pltdir:str):
+    from thermotools.plot import plt
+
+    gas = os.path.basename(fpath).split(".")[0]
+    data = store.read_table(fpath)
+
+    fig,ax = plt.subplots(1,1, figsize=(5,4))
+    ax.plot(data[0], data[1], c='k')
+    ax.set(xlabel="T [K]", ylabel=r"C$_{\text{p}}$ [J mol$^{-1}$ K$^{-1}$]")
+
+    fig.savefig(os.path.join(pltdir, "%s.png"%gas), bbox_inches='tight', dpi=170)
+    plt.close("all")
+
+# Plot the sampled Cp of all gases, across nproc processes
+def plot_all(fpaths:list, pltdir:str=None, nproc:int=1):
+    if pltdir is None:
+        pltdir = os.path.join(get_gendir(), "cp", "plt")
+    os.makedirs(pltdir, exist_ok=True)
+
+    if nproc > 1:
+        with ProcessPoolExecutor(nproc) as ex:
+            for fut in [ex.submit(plot_gas, f, pltdir) for f in fpaths]:
+                fut.result()
+    else:
+        for f in fpaths:
+            plot_gas(f, pltdir)
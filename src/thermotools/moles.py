@@ -1,12 +1,21 @@
 import numpy as np
 import os
-from thermotools import get_inpdir, empty_dir
+import json
+import re
+from functools import lru_cache
+from collections import namedtuple
+from types import MappingProxyType
+from thermotools import get_inpdir, get_gendir, store
+
+mass_electron = 5.48579909065e-7  # kg/mol
 
 def formula_from_path(f:str):
     return f.split("/")[-1].split(".")[0]
 
-def read_elements():
-    # Read table of molecular weights [kg/mol]
+# Parse the IUPAC table of atomic weights, returning masses in kg/mol
+#    Digits are grouped with spaces, and uncertainties are in brackets.
+#    Elements with no standard atomic weight (e.g. "[97]") are skipped.
+def parse_elements():
     fpath = os.path.join(get_inpdir(),"mmw","web","elements.txt")
 
     with open(fpath,'r') as hdl:
@@ -14,93 +23,185 @@ def read_elements():
 
     elem = {}
     for l in lines[2:]:
-        s = l.split()
+        s = l.split("\t")
+        if len(s) < 4:
+            continue
 
-        # key 
+        # key
         k = s[1].strip()
 
-        # value 
+        # value
         v = s[3].strip()
-        v = v.split("(")[0]
         if "[" in v:
-            continue 
-        v = float(v)
+            continue
+        v = v.split("(")[0].replace(" ","")
 
-        # store 
-        elem[k] = v
+        # store
+        elem[k] = float(v)*1.0e-3
 
-    head = "Symbol , Mass [kg mol-1]"
-    X = []
-    X_dict = {}
-    for k in elem.keys():
-        mu = elem[k]*1.0e-3
-        k = str(k)
-        X.append([k,"%.9e"%mu])
-        X_dict[k] = mu
+    return elem
 
+# Element table as a structured array, as stored in elements.npy
+element_dtype = np.dtype([("symbol", "U3"), ("mass", "f8")])
+
+# Write the element table to CSV, and to the precompiled array used by
+#    read_elements. Returns the path to the CSV.
+def write_elements():
     datdir = os.path.join(get_inpdir(),"mmw","dat")
-    empty_dir(datdir)
-    np.savetxt(os.path.join(datdir,"elements.csv"),X,fmt=["%s","%s"],delimiter=',',header=head)
+    os.makedirs(datdir, exist_ok=True)
+    fpath = os.path.join(datdir,"elements.csv")
+
+    elem = parse_elements()
+    head = "Symbol , Mass [kg mol-1]"
+    X = [[k,"%.9e"%elem[k]] for k in elem.keys()]
+    np.savetxt(fpath,X,fmt=["%s","%s"],delimiter=',',header=head)
 
-    return X_dict
+    arr = np.array([(k, float("%.9e"%elem[k])) for k in elem.keys()], dtype=element_dtype)
+    np.save(os.path.join(datdir,"elements.npy"), arr, allow_pickle=False)
 
+    return fpath
 
-# Count atoms in a molecule 
+# Read table of molecular weights [kg/mol]
+#    Loaded once per process from the precompiled array, without parsing,
+#    falling back to the CSV and then to the web table if it has not been
+#    written. Returns a read-only mapping.
+_elements = {}
+def read_elements():
+    if "table" not in _elements:
+        datdir = os.path.join(get_inpdir(),"mmw","dat")
+        npath = os.path.join(datdir,"elements.npy")
+        cpath = os.path.join(datdir,"elements.csv")
+        if os.path.exists(npath):
+            arr = np.load(npath, allow_pickle=False)
+            elem = dict(zip(arr["symbol"].tolist(), arr["mass"].tolist()))
+        elif os.path.exists(cpath):
+            elem = {}
+            with open(cpath,'r') as hdl:
+                for l in hdl:
+                    if l.startswith("#"):
+                        continue
+                    k,v = l.split(",")
+                    elem[k.strip()] = float(v)
+        else:
+            elem = parse_elements()
+        _elements["table"] = MappingProxyType(elem)
+    return _elements["table"]
+
+# Composition of a formula
+#    atoms is a tuple of (element, count) pairs sorted by element, and
+#    charge is the net charge in units of the elementary charge.
+Composition = namedtuple("Composition", ["atoms", "charge"])
+
+_re_token  = re.compile(r"([A-Z][a-z]?)(\d*)|([(\[])|([)\]])(\d*)")
+_re_charge = re.compile(r"([+-]+|[+-]\d+)$")
+
+# Parse a formula such as "C10H22", "Ca(OH)2" or "NH4+"
+#    Counts may have several digits and groups may be nested. A charge is
+#    given as trailing signs ("+", "--") or a sign and a number ("-2").
+@lru_cache(maxsize=4096)
+def parse_formula(m:str):
+    s = m.strip()
+
+    charge = 0
+    c = _re_charge.search(s)
+    if c:
+        q = c.group(1)
+        if q[1:].isdigit():
+            charge = int(q)
+        else:
+            charge = q.count("+") - q.count("-")
+        s = s[:c.start()]
+
+    # one dict of counts per open group
+    stack = [{}]
+    pos = 0
+    for tok in _re_token.finditer(s):
+        if tok.start() != pos:
+            break
+        pos = tok.end()
+        e, n, opn, cls, ng = tok.groups()
+        if e:
+            stack[-1][e] = stack[-1].get(e, 0) + int(n or 1)
+        elif opn:
+            stack.append({})
+        else:
+            if len(stack) == 1:
+                raise Exception("Unbalanced brackets in formula %s"%m)
+            grp = stack.pop()
+            k = int(ng or 1)
+            for e in grp.keys():
+                stack[-1][e] = stack[-1].get(e, 0) + grp[e] * k
+
+    if (pos != len(s)) or (len(s) == 0):
+        raise Exception("Cannot parse formula %s"%m)
+    if len(stack) != 1:
+        raise Exception("Unbalanced brackets in formula %s"%m)
+
+    return Composition(tuple(sorted(stack[0].items())), charge)
+
+# Count atoms in a molecule
 def count_atoms(m:str):
-        # Setup 
-        out = {}
-        nchar = len(m)
-        i = 0
-        e = ""
-        count = -1
-        last = False
-
-        # Loop through string
-        while i < nchar:
-            last = (i == nchar-1)
-
-            # new element 
-            # print(m[i])
-            if m[i].isupper():
-                count = 0
-                e = str(m[i])
-                if (not last) and (m[i+1].islower()):  # two letter element name 
-                    e = e+str(m[i+1])
-                    i += 1
-
-            last = (i == nchar-1)
-
-            # get count 
-            if count == 0:   # expecting number
-                # number of atoms 
-                if last or m[i+1].isalpha(): # got letter => count=1
-                    count = 1
-                else:
-                    count = int(m[i+1]) 
-
-                # repeated element 
-                if e in out.keys():
-                    out[e] += count 
-                else:
-                    out[e] = count 
-
-                # reset 
-                e = ""
-                count = -1 
-            i += 1
-        
-        return out 
+    return dict(parse_formula(m).atoms)
 
 # Calculate mmw from formula
-def mmw_from_formula(m:str, elem_table:dict):
-
-    # get atoms 
-    atoms = count_atoms(m)
+#    If m is a list of formulae, returns an array of mmw values
+def mmw_from_formula(m, elem_table:dict):
+    if not isinstance(m, str):
+        return np.array([mmw_from_formula(f, elem_table) for f in m], dtype=float)
 
-    # add up atoms 
+    comp = parse_formula(m)
     mmw = 0.0
-    for k in atoms.keys():
-        mmw += elem_table[k]*atoms[k]
-
-    return mmw
-
+    for e, n in comp.atoms:
+        mmw += elem_table[e]*n
+
+    # electrons lost or gained
+    return mmw - comp.charge * mass_electron
+
+# Canonical composition key for a formula, independent of element order
+#    e.g. "HCN" and "CNH" both give "C1H1N1", and "OH-" gives "H1O1-1"
+def composition_key(m:str):
+    comp = parse_formula(m)
+    key = "".join("%s%d"%(e,n) for e,n in comp.atoms)
+    if comp.charge != 0:
+        key += "%+d"%comp.charge
+    return key
+
+# Index from composition key to JANAF formula, for the cp tables in cpdir
+#    The index is stored as JSON next to the data, and is rebuilt whenever
+#    the cp directory has changed since it was written.
+_janaf_index = {}
+def janaf_index(cpdir:str=None):
+    if cpdir is None:
+        cpdir = os.path.join(get_gendir(),"cp","dat")
+    fpath = os.path.join(os.path.dirname(os.path.normpath(cpdir)), "janaf_index.json")
+    mtime = os.path.getmtime(cpdir)
+
+    key = (fpath, mtime)
+    if key in _janaf_index:
+        return _janaf_index[key]
+
+    # load from disk
+    index = None
+    if os.path.exists(fpath) and (os.path.getmtime(fpath) >= mtime):
+        with open(fpath, 'r') as hdl:
+            index = json.load(hdl)
+
+    # build from cp tables
+    if index is None:
+        index = {}
+        for f in store.list_tables(cpdir):
+            form = formula_from_path(f)
+            k = composition_key(form)
+            if k not in index:
+                index[k] = form
+        with open(fpath, 'w') as hdl:
+            json.dump(index, hdl, indent=1, sort_keys=True)
+
+    _janaf_index.clear()
+    _janaf_index[key] = index
+    return index
+
+# Find the name JANAF gives 'gas', based on number of atoms
+#    returns an empty string if there is no match
+def janaf_name(gas:str, cpdir:str=None):
+    return janaf_index(cpdir).get(composition_key(gas), "")
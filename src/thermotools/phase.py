@@ -1,9 +1,7 @@
 import numpy as np
-from scipy.interpolate import PchipInterpolator
-from scipy.integrate import quad
 import os
 
-from thermotools import get_gendir, get_inpdir
+from thermotools import get_gendir, get_inpdir, interp, store, Rgas
 
 mmHg = 1/0.0075006156130264  # [Pa] from https://www.convertunits.com/from/mmHg/to/Pa
 dyne_per_cm2 = 1e-1  # [Pa] from https://www.convertunits.com/from/dyne/cm2/to/Pa
@@ -170,152 +168,233 @@ gases["Ca"] = {
 for k in gases.keys():
     gases[k]["cite"].append("P.J. Linstrom and W.G. Mallard, Eds., NIST Chemistry WebBook, NIST Standard Reference Database Number 69")
 
-def antoine(t:float,gas:str):
-    gas_dict = gases[gas]
-    fit = gas_dict["fit"]
-
-    A = []
-    for f in fit:
-        t_min = f[0]
-        if t > t_min:
-            A = [f[1],f[2],f[3]]
-
-    if len(A) == 0:
-        raise Exception("Temperature out of range")
-
-    return 10**( A[0] - (A[1]/(t+A[2])) ) * 1e5  # Pa
+# Antoine equation for saturation pressure [Pa]
+#    Accepts a scalar or an array of temperatures. Each temperature uses the
+#    last fit segment with T_min below it. Temperatures at or below the first
+#    T_min are out of range: policy 'raise' raises an exception, 'nan' returns
+#    NaN for those elements, and 'clamp' evaluates them at the first T_min.
+def antoine(t, gas:str, policy:str="raise"):
+    fit = np.array(gases[gas]["fit"])
+
+    t = np.asarray(t, dtype=float)
+    iseg = np.searchsorted(fit[:,0], t, side='left') - 1
+
+    low = ~(t > fit[0,0])
+    if np.any(low):
+        match policy:
+            case "raise":
+                raise Exception("Temperature out of range")
+            case "nan":
+                t = np.where(low, np.nan, t)
+            case "clamp":
+                t = np.where(low, fit[0,0], t)
+            case _:
+                raise Exception("Unknown out-of-range policy %s"%policy)
+        iseg = np.maximum(iseg, 0)
+
+    A = fit[iseg, 1:].T
+
+    out = 10**( A[0] - (A[1]/(t+A[2])) ) * 1e5  # Pa
+    if out.ndim == 0:
+        return float(out)
+    return out
+
+# Derivative of the Antoine equation [Pa/K], with the same segments and policy
+def dantoine_dt(t, gas:str, policy:str="raise"):
+    fit = np.array(gases[gas]["fit"])
+
+    t = np.asarray(t, dtype=float)
+    iseg = np.maximum(np.searchsorted(fit[:,0], t, side='left') - 1, 0)
+    A = fit[iseg, 1:].T
+
+    # d/dt of log10(p) is A1/(t+A2)^2
+    out = antoine(t, gas, policy=policy) * np.log(10) * A[1] / (t + A[2])**2
+    if policy == "clamp":
+        out = np.where(t > fit[0,0], out, 0.0)
+    if np.ndim(out) == 0:
+        return float(out)
+    return out
 
 
 # find reference temperature & pressure using Antoine equation
+#    cached per gas, since it is needed on every Clausius-Clapeyron call
 def reference_point(gas:str):
-    t_ref = gases[gas]["fit"][0][0] + 20.0
-    p_ref = antoine(t_ref, gas)
-    return t_ref, p_ref 
+    def _build():
+        t_ref = gases[gas]["fit"][0][0] + 20.0
+        p_ref = antoine(t_ref, gas)
+        return t_ref, p_ref
+    return interp.memoize(("reference_point", gas), _build)
+
+# cumulative integral of L/(R T^2) over a latent heat table with rows [T, L]
+#    per unit mmw; the integrand is integrated over each Pchip segment by
+#    Gauss-Legendre quadrature (near machine precision at the table spacing),
+#    and the running total is stored at the segment breakpoints
+def cc_integral(table):
+    def _build():
+        itp = interp.pchip(table)
+
+        def integrand(t):
+            return itp(t) / (Rgas * t * t)
+
+        x = itp.x
+        cum = np.zeros(len(x))
+        cum[1:] = np.cumsum(interp.gauss(integrand, x[:-1], x[1:]))
+        return x, cum, integrand
+
+    return interp.memoize_table("cc_integral", table, _build)
+
+# cumulative integral for the latent heat table of gas in generated/lv/dat
+def _cc_table(gas:str):
+    fname = store.find(os.path.join(get_gendir(),"lv","dat",gas))
+    if fname is None:
+        raise FileNotFoundError("No latent heat table for %s"%gas)
+
+    table = interp.memoize(("cc", fname, os.path.getmtime(fname)),
+                            lambda: store.read_table(os.path.splitext(fname)[0], mmap=False))
+    return cc_integral(table)
 
 # calculate saturation pressure using Clausius-Clapeyron
-def cc_psat(t:float, gas:str, mmw:float):
+#    accepts a scalar or an array of temperatures; the latent heat table is
+#    loaded once per gas, unless a table with rows [T, L] is given, and the
+#    result agrees with converged quadrature of the integrand
+#    (scipy.integrate.quad) to within 1e-9 relative
+def cc_psat(t, gas:str, mmw:float, table=None):
 
-    # find l_vap data
-    fname = os.path.join(get_gendir(),"lv","dat")+"/%s.csv"%gas
     t_ref, p_ref = reference_point(gas)
-    data = np.loadtxt(fname, delimiter=',').T
-    vap_T = data[0]
-    vap_L = data[1] * mmw  # convert to J/mol 
-
-    itp = PchipInterpolator(vap_T, vap_L)
-
-    def integrand(t:float):
-        L = itp(t)
-        return L / (8.314 * t * t)
-    
-    integ = quad(integrand, t_ref, t)
-    rhs = integ[0]
-    out = np.exp(rhs) * p_ref 
-    return out 
-
-def woitke_load_gas(gas:str):
-    # load gas data from Woitke+2017 derived CSV File
-    # these are from Table D2
+    x, cum, integrand = _cc_table(gas) if table is None else cc_integral(table)
+
+    # integral from the first table point to each temperature
+    def _integ(t):
+        k = np.clip(np.searchsorted(x, t, side='right') - 1, 0, len(x)-2)
+        return cum[k] + interp.gauss(integrand, x[k], t)
+
+    t = np.asarray(t, dtype=float)
+    rhs = (_integ(t) - _integ(np.asarray(t_ref, dtype=float))) * mmw  # J/kg to J/mol
+    out = np.exp(rhs) * p_ref
+    if out.ndim == 0:
+        return float(out)
+    return out
+
+# derivative of cc_psat [Pa/K], from dp/dT = p L / (R T^2)
+def dcc_psat_dt(t, gas:str, mmw:float, table=None):
+    x, cum, integrand = _cc_table(gas) if table is None else cc_integral(table)
+    t = np.asarray(t, dtype=float)
+    out = cc_psat(t, gas, mmw, table) * integrand(t) * mmw
+    if out.ndim == 0:
+        return float(out)
+    return out
+
+# Woitke+2017 phase change data, from Table D2
+#    The table is parsed once, on first access, into a typed array holding
+#    one row per species: the first row with a saturation pressure fit
+#    (deltaG fit types 1, 2 and 5 are skipped). woitke_data and woitke_gases
+#    are built from it, excluding species already in the gases dictionary.
+verbose = False
+
+woitke_dtype = np.dtype([
+    ("gas",      "U16"),
+    ("fit_type", "i4"),
+    ("T_min",    "f8"),
+    ("T_max",    "f8"),
+    ("density",  "f8"),   # density of condensed phase (g/cm^3)
+    ("c",        "f8", (5,)),  # fit coefficients c0 to c4
+])
+
+_woitke = {}
+
+def _woitke_parse():
     fname = os.path.join(get_inpdir(),"psat","web", "woitke2017_TableD2.csv")
     data = np.loadtxt(fname, delimiter=',', dtype=str, comments='#', skiprows=1).T
 
-    # locate row for this gas
-    igas = -1
-    for i,g in enumerate(data[1]):
-        if gas in g:
-            print("Querying Woitke+2017 phase change data for %s"%gas)
-            if igas>-1:
-                print(f"    multiple entries for {gas}, found: {data[1][igas]} and {data[1][i]}")
-                if "[s" in data[2][i]:
-                    igas = i
-            else:
-                igas = i
-
-    # not found?
-    if igas == -1:
-        print("Gas %s not found in Woitke+2017 phase change data (Table D2)"%gas)
-        return None
-    else:
-        print(f"    using {data[1][igas]} data for {gas}")
-    
     def _val_or_default(val, default):
         if val == "":
             return default
         else:
             return float(val)
 
-    # convert to dictionary
-    data = {
-        # metadata
-        "gas": str(data[1][igas]).split("[")[0],
-        "fit_type": int(data[2][igas]),
-        "T_min": _val_or_default(data[4][igas], 0.0),
-        "T_max": _val_or_default(data[5][igas], 1e9),
-
-        # density of condensed phase (g/cm^3)
-        "density": float(data[3][igas]),
-
-        # fit coefficients
-        "c0": _val_or_default(data[6][igas],  0.0),
-        "c1": _val_or_default(data[7][igas],  0.0),
-        "c2": _val_or_default(data[8][igas],  0.0),
-        "c3": _val_or_default(data[9][igas],  0.0),
-        "c4": _val_or_default(data[10][igas], 0.0),
+    rows = []
+    seen = set()
+    for i in range(len(data[1])):
+        gas = str(data[1][i]).split("[")[0]
+        fit_type = int(data[2][i])
+
+        # only store cases with fits for psat, skip deltaG cases
+        if (gas in seen) or (fit_type in [1,2,5]):
+            continue
+        seen.add(gas)
+
+        rows.append((gas, fit_type,
+                    _val_or_default(data[4][i], 0.0),
+                    _val_or_default(data[5][i], 1e9),
+                    float(data[3][i]),
+                    [_val_or_default(data[6+k][i], 0.0) for k in range(5)]))
+
+    return np.array(rows, dtype=woitke_dtype)
+
+# typed table of all species with psat fits
+def woitke_table():
+    if "table" not in _woitke:
+        _woitke["table"] = _woitke_parse()
+    return _woitke["table"]
+
+def _woitke_dict(row):
+    out = {
+        "gas": str(row["gas"]),
+        "fit_type": int(row["fit_type"]),
+        "T_min": float(row["T_min"]),
+        "T_max": float(row["T_max"]),
+        "density": float(row["density"]),
     }
+    for k in range(5):
+        out["c%d"%k] = float(row["c"][k])
+    return out
 
-    # only store cases with fits for psat, skip deltaG cases
-    if data["fit_type"] in [1,2,5]:
+# load gas data as a dictionary, or None if not available
+def woitke_load_gas(gas:str):
+    table = woitke_table()
+    i = np.flatnonzero(table["gas"] == gas)
+    if len(i) == 0:
+        if verbose:
+            print("Gas %s not found in Woitke+2017 phase change data (Table D2)"%gas)
         return None
+    return _woitke_dict(table[i[0]])
 
-    return data
-
+# load all Woitke+2017 data for species not in the gases dictionary
 def woitke_load_all():
-    # load all Woitke+2017 data
-    fname = os.path.join(get_inpdir(),"psat","web", "woitke2017_TableD2.csv")
-    data = np.loadtxt(fname, delimiter=',', dtype=str, comments='#', skiprows=1).T
-
-    parsed_data = {}
-    seen_gases = list(gases.keys()) # don't load these twice
-
-    for i in range(len(data[1])):
-        gas = str(data[1][i]).split("[")[0]
-        if gas not in seen_gases:
-            gas_data = woitke_load_gas(gas)
-            if gas_data is not None:
-                parsed_data[gas] = gas_data
-                seen_gases.append(gas)
-
-    return parsed_data
-
-# load the data globally
-woitke_data = woitke_load_all()
-woitke_gases = list(woitke_data.keys())
-print("Loaded Woitke+2017 phase change data for %d gases"%len(woitke_gases))
-print("    gases: %s"%(", ".join(woitke_gases)))
-
-def woitke_psat(t:float, gas:str):
-    # calculate saturation pressure using Woitke+2017 data
-
-    # get this gas
-    if gas not in woitke_gases:
-        raise Exception("Gas %s not found in Woitke+2017 phase change data (Table D2)"%gas)
-    gas_data = woitke_data[gas]
-    c0 = gas_data["c0"]
-    c1 = gas_data["c1"]
-    c2 = gas_data["c2"]
-    c3 = gas_data["c3"]
-    c4 = gas_data["c4"]
-
-    # handle temperature range
-    t = float(t)
-    t = max(t, gas_data["T_min"])
-    t = min(t, gas_data["T_max"])
+    if "data" not in _woitke:
+        data = {}
+        for row in woitke_table():
+            if row["gas"] not in gases:
+                data[str(row["gas"])] = _woitke_dict(row)
+        _woitke["data"] = data
+        _woitke["gases"] = list(data.keys())
+
+        if verbose:
+            print("Loaded Woitke+2017 phase change data for %d gases"%len(data))
+            print("    gases: %s"%(", ".join(_woitke["gases"])))
+
+    return _woitke["data"]
+
+# woitke_data and woitke_gases are loaded when first accessed
+def __getattr__(name:str):
+    if name == "woitke_data":
+        return woitke_load_all()
+    if name == "woitke_gases":
+        woitke_load_all()
+        return _woitke["gases"]
+    raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+# Woitke+2017 fit equations, evaluated elementwise
+#    t is temperature [K], already clamped to the fit range, and c holds the
+#    five coefficients c0 to c4 broadcastable against t. Returns psat [Pa].
+def _woitke_kernel(fit_type:int, t, c):
+    c0, c1, c2, c3, c4 = c
 
     # celcius for some fits
     tc = t - 273.15
 
     # these are the various fit equations
-    match gas_data["fit_type"]:
+    match fit_type:
         case 1:
             #  Sharp & Huebner (1990)
             raise Exception("Woitke+2017 fit type 1 not yet implemented")
@@ -355,5 +434,51 @@ def woitke_psat(t:float, gas:str):
             return np.exp(ln_P) * dyne_per_cm2 # dyne/cm^2 to Pa
         
         case _:
-            raise Exception("Woitke+2017 fit type %d not yet implemented"%gas_data["fit_type"])
-        
\ No newline at end of file
+            raise Exception("Woitke+2017 fit type %d not yet implemented"%fit_type)
+
+# rows of the Woitke+2017 table for a list of gases
+def _woitke_rows(gas_list):
+    woitke_data = woitke_load_all()
+    if "index" not in _woitke:
+        _woitke["index"] = {str(g):i for i,g in enumerate(woitke_table()["gas"])}
+    for gas in gas_list:
+        if gas not in woitke_data:
+            raise Exception("Gas %s not found in Woitke+2017 phase change data (Table D2)"%gas)
+    return woitke_table()[[_woitke["index"][g] for g in gas_list]]
+
+# calculate saturation pressure using Woitke+2017 data
+#    accepts a scalar or an array of temperatures, which are clamped to the
+#    temperature range of the fit
+def woitke_psat(t, gas:str):
+    row = _woitke_rows([gas])[0]
+
+    # handle temperature range
+    t = np.clip(np.asarray(t, dtype=float), row["T_min"], row["T_max"])
+
+    out = _woitke_kernel(int(row["fit_type"]), t, row["c"])
+    if np.ndim(out) == 0:
+        return float(out)
+    return out
+
+# calculate saturation pressure for many gases at once
+#    Gases are grouped by fit type, so that each group is evaluated with
+#    one vector operation. Returns an array with shape (len(gas_list),)+t.shape
+def woitke_psat_many(t, gas_list:list):
+    rows = _woitke_rows(gas_list)
+    t = np.asarray(t, dtype=float)
+
+    # broadcast species along the first axis
+    shape = (len(rows),) + (1,)*t.ndim
+    out = np.empty((len(rows),) + t.shape)
+
+    for fit_type in np.unique(rows["fit_type"]):
+        sel = rows["fit_type"] == fit_type
+        grp = rows[sel]
+        n = len(grp)
+
+        t_grp = np.clip(t, grp["T_min"].reshape((n,)+shape[1:]),
+                           grp["T_max"].reshape((n,)+shape[1:]))
+        c = grp["c"].T.reshape((5,n)+shape[1:])
+        out[sel] = _woitke_kernel(int(fit_type), t_grp, c)
+
+    return out
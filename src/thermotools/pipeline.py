@@ -0,0 +1,410 @@
+# Incremental runner for the workflow stages
+#    Usage: python -m thermotools.pipeline [stage ...] [--force] [--jobs N]
+#                                          [--nproc N] [--dry-run]
+#
+#    The stages form a dependency graph over the files in the input data
+#    directory and under get_gendir(). Each stage is keyed by BLAKE2b hashes
+#    of its notebook, the library modules which it imports (directly or
+#    through other modules), the input data which it reads, and the outputs of the stages which it depends on. A stage is skipped if its
+#    key and outputs match the manifest from the last run, so a stage whose
+#    outputs do not change on a rebuild does not trigger the stages after it.
+#    Independent stages are run concurrently.
+#
+#    Notebook stages are executed with nbconvert, and the executed copies are
+#    kept under get_gendir()/pipeline. The compile stage is run through the
+#    compile module, and only rebuilds species whose input tables changed.
+#    Its plots are made by the 99_compile notebook.
+
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from thermotools import get_gendir, get_inpdir, moles, store
+from thermotools.util import checksum
+
+_SRC = os.path.dirname(os.path.abspath(__file__))
+_WORKFLOW = os.path.join(os.path.dirname(os.path.dirname(_SRC)), "workflow")
+
+# Stages, in order
+#    notebook : in the workflow directory, or None for the compile stage
+#    deps     : stages whose outputs are read
+#    modules  : library modules run by the stage, besides those imported by
+#               its notebook; the modules these import are found by
+#               stage_modules
+#    inputs   : directories under get_inpdir() which are read
+#    outputs  : directories under get_gendir() which are written
+stages = {
+    "cp_download": {
+        "notebook": "01_cp_download.ipynb",
+        "deps"    : [],
+        "modules" : [],
+        "inputs"  : [],
+        "outputs" : ["cp/web"],
+    },
+    "cp": {
+        "notebook": "02_cp_parse.ipynb",
+        "deps"    : ["cp_download"],
+        "modules" : [],
+        "inputs"  : [],
+        "outputs" : ["cp/dat"],
+    },
+    "lv": {
+        "notebook": "03_lv_parse.ipynb",
+        "deps"    : [],
+        "modules" : [],
+        "inputs"  : ["lv/web", "mmw/dat"],
+        "outputs" : ["lv/dat"],
+    },
+    "psat": {
+        "notebook": "04_psat_parse.ipynb",
+        "deps"    : ["lv"],
+        "modules" : [],
+        "inputs"  : ["psat/web", "mmw/dat"],
+        "outputs" : ["sat/dat"],
+    },
+    "vdw": {
+        "notebook": "05_vdw_tabulate.ipynb",
+        "deps"    : [],
+        "modules" : [],
+        "inputs"  : ["mmw/dat"],
+        "outputs" : ["vdw/dat"],
+    },
+    "aqua": {
+        "notebook": "06_aqua_tabulate.ipynb",
+        "deps"    : [],
+        "modules" : [],
+        "inputs"  : [],
+        "outputs" : ["aqua/dat"],
+    },
+    "cms19": {
+        "notebook": "07_chabrier_tabulate.ipynb",
+        "deps"    : [],
+        "modules" : [],
+        "inputs"  : [],
+        "outputs" : ["cms19/dat"],
+    },
+    "compile": {
+        "notebook": None,
+        "deps"    : ["cp", "lv", "psat", "vdw", "aqua", "cms19"],
+        "modules" : ["compile.py"],
+        "inputs"  : ["mmw/dat"],
+        "outputs" : ["compiled/dat"],
+    },
+}
+
+def get_pipedir():
+    return os.path.join(get_gendir(), "pipeline")
+
+def _manifest_path():
+    return os.path.join(get_pipedir(), "manifest.json")
+
+# Manifest of stage keys and file hashes from previous runs
+_manifest = {"stages":{}, "files":{}}
+_lock = threading.Lock()
+
+def load_manifest():
+    fpath = _manifest_path()
+    _manifest["stages"] = {}
+    _manifest["files"] = {}
+    if os.path.exists(fpath):
+        with open(fpath, 'r') as hdl:
+            _manifest.update(json.load(hdl))
+    return _manifest
+
+def save_manifest():
+    os.makedirs(get_pipedir(), exist_ok=True)
+    with _lock:
+        tmp = _manifest_path() + ".tmp"
+        with open(tmp, 'w') as hdl:
+            json.dump(_manifest, hdl, indent=1, sort_keys=True)
+        os.replace(tmp, _manifest_path())
+
+# Checksum of a file, reusing the manifest's value if its size and
+#    modification time are unchanged
+def file_hash(fpath:str):
+    st = os.stat(fpath)
+    key = os.path.abspath(fpath)
+    rec = _manifest["files"].get(key)
+    if (rec is not None) and (rec[0] == st.st_size) and (rec[1] == st.st_mtime_ns):
+        return rec[2]
+    h = checksum(fpath)
+    with _lock:
+        _manifest["files"][key] = [st.st_size, st.st_mtime_ns, h]
+    return h
+
+# Combined hash of a list of (name, hash) pairs
+def _combine(items):
+    d = hashlib.blake2b()
+    for name, h in items:
+        d.update(("%s:%s\n"%(name, h)).encode())
+    return d.hexdigest()
+
+# Hash of all files under a directory, by path relative to that directory
+def dir_hash(dirpath:str):
+    items = []
+    for f in sorted(glob.glob(os.path.join(dirpath, "**", "*"), recursive=True)):
+        if os.path.isfile(f):
+            items.append((os.path.relpath(f, dirpath), file_hash(f)))
+    return _combine(items)
+
+# Hash of the outputs of a stage
+def output_hash(name:str):
+    return _combine([(d, dir_hash(os.path.join(get_gendir(), d)))
+                        for d in stages[name]["outputs"]])
+
+# Library modules imported by the python source src
+#    Includes imports inside functions, so optional imports are counted.
+def _imports(src:str):
+    found = set()
+    for node in ast.walk(ast.parse(src)):
+        match node:
+            case ast.ImportFrom(module="thermotools", names=names):
+                found.update(a.name for a in names)
+            case ast.ImportFrom(module=str(m)) if m.startswith("thermotools."):
+                found.add(m.split(".")[1])
+            case ast.Import(names=names):
+                found.update(a.name.split(".")[1] for a in names if a.name.startswith("thermotools."))
+    return {f+".py" for f in found if os.path.isfile(os.path.join(_SRC, f+".py"))}
+
+# Python source of the code cells of a notebook, without IPython magics
+def _notebook_source(fpath:str):
+    with open(fpath, 'r') as hdl:
+        nb = json.load(hdl)
+    lines = []
+    for cell in nb["cells"]:
+        if cell["cell_type"] == "code":
+            src = "".join(cell["source"])
+            lines += [l for l in src.splitlines() if not l.lstrip().startswith(("%", "!"))]
+    return "\n".join(lines)
+
+# Library modules used by a stage, as the closure of its imports
+#    Starts from the imports of its notebook and its own modules, and follows
+#    the imports of each module reached. Always includes __init__.py.
+def stage_modules(name:str):
+    st = stages[name]
+    todo = set(st["modules"])
+    if st["notebook"] is not None:
+        todo |= _imports(_notebook_source(os.path.join(_WORKFLOW, st["notebook"])))
+    found = {"__init__.py"}
+    while todo:
+        m = todo.pop()
+        if m not in found:
+            found.add(m)
+            with open(os.path.join(_SRC, m), 'r') as hdl:
+                todo |= _imports(hdl.read())
+    return sorted(found)
+
+# Key of a stage, from its own files and the current outputs of its deps
+def stage_key(name:str):
+    st = stages[name]
+    items = []
+    if st["notebook"] is not None:
+        items.append((st["notebook"], file_hash(os.path.join(_WORKFLOW, st["notebook"]))))
+    for m in stage_modules(name):
+        items.append((m, file_hash(os.path.join(_SRC, m))))
+    for d in st["inputs"]:
+        items.append(("input/"+d, dir_hash(os.path.join(get_inpdir(), d))))
+    for d in st["deps"]:
+        items.append(("stage/"+d, output_hash(d)))
+    return _combine(items)
+
+# Check if a stage is up to date, returning its key
+def up_to_date(name:str):
+    key = stage_key(name)
+    rec = _manifest["stages"].get(name)
+    if (rec is None) or (rec["key"] != key):
+        return False, key
+    return rec["outputs"] == output_hash(name), key
+
+# Stages needed for targets, including their dependencies, in order
+def _closure(targets):
+    need = set()
+    def _add(n):
+        if n not in stages:
+            raise Exception("Unknown stage %s"%n)
+        if n not in need:
+            need.add(n)
+            for d in stages[n]["deps"]:
+                _add(d)
+    for t in targets:
+        _add(t)
+    return [n for n in stages.keys() if n in need]
+
+# Execute a notebook stage with nbconvert
+def _run_notebook(name:str):
+    nb = os.path.join(_WORKFLOW, stages[name]["notebook"])
+    logdir = get_pipedir()
+    os.makedirs(logdir, exist_ok=True)
+    cmd = [sys.executable, "-m", "nbconvert", "--to", "notebook", "--execute",
+            "--ExecutePreprocessor.timeout=-1", "--output-dir", logdir, nb]
+    out = subprocess.run(cmd, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise Exception("Stage %s failed:\n%s"%(name, out.stderr[-2000:]))
+
+# Key for each species in the compile stage, from its input tables
+def _species_key(gas:str, janaf:str, code:str):
+    g = get_gendir()
+    paths = [os.path.join(g, "sat", "dat", "%s_%s"%(gas, s)) for s in ("sat", "crit", "trip")]
+    paths += [os.path.join(g, "lv", "dat", gas), os.path.join(g, "vdw", "dat", gas)]
+    if len(janaf) > 0:
+        paths.append(os.path.join(g, "cp", "dat", janaf))
+    if gas == "H2O":
+        paths.append(os.path.join(g, "aqua", "dat", "H2O"))
+    if gas == "H2":
+        paths.append(os.path.join(g, "cms19", "dat", "H2"))
+
+    items = [("code", code), ("janaf", janaf)]
+    for p in paths:
+        f = store.find(p)
+        if f is not None:
+            items.append((os.path.relpath(f, g), file_hash(f)))
+    return _combine(items)
+
+# Compile stage, rebuilding only the species whose inputs changed
+def _run_compile(nproc:int):
+    from thermotools import compile
+    from thermotools.util import makezip
+
+    datdir = compile.get_datdir()
+    os.makedirs(datdir, exist_ok=True)
+
+    meta = compile.metadata()
+    gases = compile.gas_list()
+    code = _combine([(m, file_hash(os.path.join(_SRC, m))) for m in stage_modules("compile")])
+
+    rec = _manifest["stages"].get("compile", {})
+    prev = rec.get("species", {})
+    keys = {}
+    todo = []
+    for gas in gases:
+        janaf = meta["janaf"].get(moles.composition_key(gas), "")
+        keys[gas] = _species_key(gas, janaf, code)
+        ncpath = os.path.join(datdir, "%s.nc"%gas)
+        if (prev.get(gas) != keys[gas]) or (len(janaf) > 0 and not os.path.exists(ncpath)):
+            todo.append(gas)
+
+    # remove files for species which are no longer compiled
+    removed = 0
+    for f in glob.glob(os.path.join(datdir, "*.nc")):
+        gas = os.path.basename(f)[:-3]
+        if (gas not in keys) or (len(meta["janaf"].get(moles.composition_key(gas), "")) == 0):
+            removed += 1
+            for p in (f, f+".chk"):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    print("    %d of %d species to compile"%(len(todo), len(gases)))
+    compile.compile_all(todo, datdir, nproc=nproc, meta=meta)
+
+    # zip and archive, if any species changed
+    zpath = os.path.join(datdir, "gases.zip")
+    if (len(todo) > 0) or (removed > 0) or not os.path.exists(zpath):
+        files = [os.path.abspath(f) for f in glob.glob(os.path.join(datdir, "*.nc*"))]
+        makezip(zpath, sorted(files))
+        compile.compile_archive(gases, meta=meta)
+
+    return keys
+
+# Run a stage, recording it in the manifest
+def run_stage(name:str, key:str, nproc:int=1):
+    t0 = time.perf_counter()
+    print("[%s] running"%name)
+
+    species = None
+    if stages[name]["notebook"] is None:
+        species = _run_compile(nproc)
+    else:
+        _run_notebook(name)
+
+    rec = {"key":key, "outputs":output_hash(name), "time":time.perf_counter()-t0}
+    if species is not None:
+        rec["species"] = species
+    with _lock:
+        _manifest["stages"][name] = rec
+    save_manifest()
+
+    print("[%s] done in %.1f s"%(name, rec["time"]))
+
+# Run the targets and their dependencies
+#    Returns a dict of the status of each stage: 'skipped', 'ran', 'failed'
+#    or 'blocked' (a dependency failed).
+def run(targets=None, force:bool=False, jobs:int=1, nproc:int=1, dry_run:bool=False):
+    if (targets is None) or (len(targets) == 0):
+        targets = list(stages.keys())
+    order = _closure(targets)
+    forced = set(order) if force else set()
+
+    load_manifest()
+    status = {}
+
+    # dry run: report stages which are out of date, or downstream of one
+    if dry_run:
+        for n in order:
+            upstream = any(status[d] != "skipped" for d in stages[n]["deps"] if d in status)
+            ok = up_to_date(n)[0]
+            status[n] = "skipped" if (ok and not upstream and n not in forced) else "would run"
+            print("[%s] %s"%(n, status[n]))
+        return status
+
+    pending = list(order)
+    running = {}
+    with ThreadPoolExecutor(max(1, jobs)) as ex:
+        while pending or running:
+            # start stages whose dependencies are finished
+            for n in list(pending):
+                deps = [d for d in stages[n]["deps"] if d in order]
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    status[n] = "blocked"
+                    pending.remove(n)
+                    print("[%s] blocked"%n)
+                    continue
+                if not all(d in status for d in deps):
+                    continue
+                pending.remove(n)
+
+                ok, key = up_to_date(n)
+                if ok and (n not in forced):
+                    status[n] = "skipped"
+                    print("[%s] up to date"%n)
+                    continue
+                running[ex.submit(run_stage, n, key, nproc)] = n
+
+            if not running:
+                continue
+
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for fut in done:
+                n = running.pop(fut)
+                try:
+                    fut.result()
+                    status[n] = "ran"
+                except Exception as e:
+                    status[n] = "failed"
+                    print("[%s] failed: %s"%(n, e))
+
+    save_manifest()
+    return status
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m thermotools.pipeline",
+                                        description="Run the ThermoTools workflow stages incrementally")
+    parser.add_argument("stages", nargs="*", help="stages to run, with their dependencies (default: all of %s)"%", ".join(stages.keys()))
+    parser.add_argument("--force", action="store_true", help="run the stages even if they are up to date")
+    parser.add_argument("--jobs", type=int, default=1, help="number of stages to run concurrently")
+    parser.add_argument("--nproc", type=int, default=os.cpu_count(), help="processes for compiling species")
+    parser.add_argument("--dry-run", action="store_true", help="only report which stages would run")
+    args = parser.parse_args(argv)
+
+    status = run(args.stages, force=args.force, jobs=args.jobs, nproc=args.nproc, dry_run=args.dry_run)
+    return 1 if any(s in ("failed", "blocked") for s in status.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,487 @@
+# Fast lookups of compiled species data
+#    Species are read from the compiled netCDF files, or from the groups of
+#    the single-file archive, on first use. Each table is loaded into memory
+#    once, and loaded species are kept in a bounded LRU cache. Tables on
+#    uniform grids (apart from a final point at the critical temperature)
+#    are looked up by index arithmetic over the uniform part of each axis,
+#    falling back to a binary search beyond it and on adaptive grids.
+
+import os
+import numpy as np
+import netCDF4 as nc
+from collections import OrderedDict
+
+from thermotools import water, phase, Rgas
+from thermotools.compile import get_datdir
+
+# Maximum number of species held in memory
+maxsize = 64
+
+# Path to the compiled data: a directory of per-species files, or an archive
+#    None uses the per-species files under get_gendir()
+_source = {"path": None}
+_cache = OrderedDict()
+
+# Set the path to the compiled data, dropping any cached species
+def set_source(path:str=None):
+    _source["path"] = path
+    _cache.clear()
+
+# Grid axis, with index arithmetic over its uniform part
+class Axis:
+    def __init__(self, x):
+        x = np.array(x, dtype=float)
+        if (len(x) < 2) or np.any(np.diff(x) <= 0):
+            raise Exception("Axis must be strictly increasing, with at least two points")
+        self.x = x
+
+        # number of leading points which are uniformly spaced
+        d = np.diff(x)
+        self.dx = d[0]
+        bad = np.flatnonzero(np.abs(d - self.dx) > 1e-6 * self.dx)
+        self.nu = len(x) if len(bad) == 0 else int(bad[0]) + 1
+        self.nu = max(self.nu, 2)
+
+    # Segment index and weight of each point, clamped to the axis
+    #    Also returns a mask of the points outside the axis. Non-finite
+    #    points are located at the start of the axis, with a NaN weight, so
+    #    values interpolated at them are NaN whatever the out-of-range policy.
+    def locate(self, t):
+        x = self.x
+        t = np.asarray(t, dtype=float)
+        bad = ~np.isfinite(t)
+        out = ((t < x[0]) | (t > x[-1])) & ~bad
+        t = np.clip(np.where(bad, x[0], t), x[0], x[-1])
+
+        i = ((t - x[0]) * (1.0 / self.dx)).astype(np.intp)
+        np.minimum(i, self.nu - 2, out=i)
+
+        if self.nu < len(x):
+            tail = t > x[self.nu - 1]
+            if np.any(tail):
+                i[tail] = np.minimum(np.searchsorted(x, t[tail], side='right') - 1, len(x) - 2)
+
+        w = (t - x[i]) / (x[i+1] - x[i])
+        w[bad] = np.nan
+        return i, w, out
+
+# Apply out-of-range policy to interpolated values, as in phase.antoine
+#    'clamp' keeps the value at the nearest end of the table, 'nan' returns
+#    NaN, and 'raise' raises an exception.
+def _policy(v, out, policy:str):
+    match policy:
+        case "clamp":
+            pass
+        case "nan":
+            v[out] = np.nan
+        case "raise":
+            if np.any(out):
+                raise Exception("Value out of range of table")
+        case _:
+            raise Exception("Unknown out-of-range policy %s"%policy)
+    return v
+
+def _out(v):
+    if v.ndim == 0:
+        return float(v)
+    return v
+
+# Polish temperatures t so that psat(t) = exp(lnp), by Newton's method in ln p
+#    Steps are kept within [tmin, tmax], and are only accepted where they
+#    reduce the residual.
+def _newton(t, lnp, psat, dpsat_dt, tmin:float, tmax:float, newton:int=3):
+    ps = psat(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = np.log(ps) - lnp
+        for _ in range(newton):
+            t_new = np.clip(t - f * ps / dpsat_dt(t), tmin, tmax)
+            ps_new = psat(t_new)
+            f_new = np.log(ps_new) - lnp
+            better = np.abs(f_new) < np.abs(f)
+            t  = np.where(better, t_new, t)
+            ps = np.where(better, ps_new, ps)
+            f  = np.where(better, f_new, f)
+    return t
+
+# Lookup tables for one species
+class Species:
+    def __init__(self, gas:str, path:str=None):
+        self.gas = gas
+        self.path = path
+        self._tables = {}
+
+        if path is None:
+            self.fpath = os.path.join(get_datdir(), "%s.nc"%gas)
+            self.group = None
+        elif os.path.isdir(path):
+            self.fpath = os.path.join(path, "%s.nc"%gas)
+            self.group = None
+        else:
+            self.fpath = path
+            self.group = gas
+
+        if not os.path.exists(self.fpath):
+            raise FileNotFoundError("Compiled data not found: %s"%self.fpath)
+
+    # Read variables from the dataset, returning None if any are missing
+    def _read(self, names):
+        with nc.Dataset(self.fpath, 'r') as ds:
+            if self.group is not None:
+                if self.group not in ds.groups:
+                    raise Exception("Species %s not in archive %s"%(self.gas, self.fpath))
+                ds = ds.groups[self.group]
+            if any(n not in ds.variables for n in names):
+                return None
+            return [np.array(ds.variables[n][:], dtype=float) for n in names]
+
+    # Check if the dataset has a variable, caching the result
+    def has(self, name:str):
+        key = ("has", name)
+        if key not in self._tables:
+            self._tables[key] = self._read((name,)) is not None
+        return self._tables[key]
+
+    # 1D table with axis x and values y, loaded on first use
+    def _table1d(self, x:str, y:str):
+        key = (x, y)
+        if key not in self._tables:
+            v = self._read((x, y))
+            if v is None:
+                raise Exception("No %s data for %s"%(y, self.gas))
+            self._tables[key] = (Axis(v[0]), v[1])
+        return self._tables[key]
+
+    # 2D table prefix_rho on axes (prefix_P, prefix_T), loaded on first use
+    def _table2d(self, prefix:str):
+        if prefix not in self._tables:
+            v = self._read((prefix+"_T", prefix+"_P", prefix+"_rho"))
+            if v is None:
+                raise Exception("No %s EOS for %s"%(prefix, self.gas))
+            self._tables[prefix] = (Axis(v[0]), Axis(v[1]), v[2])
+        return self._tables[prefix]
+
+    def _interp1d(self, x:str, y:str, t, policy:str):
+        axis, val = self._table1d(x, y)
+        t = np.asarray(t, dtype=float)
+        i, w, out = axis.locate(np.atleast_1d(t))
+        v = val[i] + w * (val[i+1] - val[i])
+        return _policy(v, out, policy).reshape(t.shape)
+
+    # Saturation pressure [Pa], interpolated in log P
+    def psat(self, t, policy:str="clamp"):
+        return _out(10.0 ** self._interp1d("sat_T", "sat_P", t, policy))
+
+    # Latent heat [J kg-1]
+    def latent_heat(self, t, policy:str="clamp"):
+        return _out(self._interp1d("lat_T", "lat_H", t, policy))
+
+    # Heat capacity [J K-1 kg-1]
+    def cp(self, t, policy:str="clamp"):
+        return _out(self._interp1d("cap_T", "cap_C", t, policy))
+
+    # Heat capacity with its enthalpy and entropy, loaded on first use
+    def _cap(self):
+        if "cap" not in self._tables:
+            v = self._read(("cap_T", "cap_C", "cap_H", "cap_S"))
+            if v is None:
+                raise Exception("No enthalpy or entropy data for %s"%self.gas)
+            self._tables["cap"] = (Axis(v[0]), v[1], v[2], v[3])
+        return self._tables["cap"]
+
+    # Enthalpy and entropy at t, from the tabulated values at the grid point
+    #    below t and the exact integral of the interpolated Cp beyond it
+    def _integrals(self, t, policy:str):
+        axis, c, h, s = self._cap()
+        t = np.asarray(t, dtype=float)
+        i, w, out = axis.locate(np.atleast_1d(t))
+        x0 = axis.x[i]
+        dx = axis.x[i+1] - x0
+        slope = (c[i+1] - c[i]) / dx
+        d = w * dx
+
+        hv = h[i] + d * (c[i] + 0.5 * slope * d)
+        sv = s[i] + (c[i] - slope * x0) * np.log1p(d / x0) + slope * d
+        tv = x0 + d
+        return (_policy(hv, out, policy).reshape(t.shape),
+                _policy(sv, out, policy).reshape(t.shape),
+                tv.reshape(t.shape))
+
+    # Enthalpy H(T) - H(T_ref) [J kg-1]
+    def enthalpy(self, t, policy:str="clamp"):
+        return _out(self._integrals(t, policy)[0])
+
+    # Entropy [J K-1 kg-1]
+    def entropy(self, t, policy:str="clamp"):
+        return _out(self._integrals(t, policy)[1])
+
+    # Gibbs free energy G(T) - H(T_ref) [J kg-1]
+    def gibbs(self, t, policy:str="clamp"):
+        h, s, t = self._integrals(t, policy)
+        return _out(h - t * s)
+
+    # Molecular weight [kg mol-1]
+    def mmw(self):
+        if "mmw" not in self._tables:
+            self._tables["mmw"] = float(self._read(("mmw",))[0])
+        return self._tables["mmw"]
+
+    # Saturation curve with axis log P, for inversion
+    #    Points which do not increase in pressure are dropped, so that the
+    #    inverse is single-valued.
+    def _tsat_table(self):
+        if "tsat" not in self._tables:
+            t, lp = self._read(("sat_T", "sat_P"))
+            keep = np.ones(len(lp), dtype=bool)
+            keep[1:] = np.diff(np.maximum.accumulate(lp)) > 0
+            self._tables["tsat"] = (Axis(lp[keep]), t[keep])
+        return self._tables["tsat"]
+
+    # Analytic saturation curve and its derivative, where there is one
+    #    These are the sources of the tabulated curves in the psat stage.
+    #    Clausius-Clapeyron curves are built from the compiled latent heat,
+    #    and without it the curve is not polished.
+    def _analytic(self):
+        gas = self.gas
+        if gas == "H2O":
+            return water.psat_both, water.dpsat_both_dt
+        if gas in phase.gases.keys():
+            match phase.gases[gas]["prefer"]:
+                case "antoine":
+                    return (lambda t: phase.antoine(t, gas, policy="clamp"),
+                            lambda t: phase.dantoine_dt(t, gas, policy="clamp"))
+                case "cc":
+                    # from the compiled latent heat, if there is one
+                    if not self.has("lat_H"):
+                        return None
+                    if "cc" not in self._tables:
+                        self._tables["cc"] = np.array(self._read(("lat_T", "lat_H")))
+                    table = self._tables["cc"]
+                    mmw = self.mmw()
+                    return (lambda t: phase.cc_psat(t, gas, mmw, table),
+                            lambda t: phase.dcc_psat_dt(t, gas, mmw, table))
+        return None
+
+    # Saturation temperature [K] at pressure p [Pa]
+    #    Linear inversion of the tabulated curve in log P. If polish is True,
+    #    this is refined with Newton's method where the curve is analytic.
+    def tsat(self, p, polish:bool=True, policy:str="clamp"):
+        axis, tv = self._tsat_table()
+        p = np.asarray(p, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lp = np.log10(np.atleast_1d(p)).ravel()
+
+        i, w, out = axis.locate(lp)
+        t = tv[i] + w * (tv[i+1] - tv[i])
+
+        fns = self._analytic() if polish else None
+        inr = ~out & np.isfinite(t)
+        if (fns is not None) and np.any(inr):
+            t[inr] = _newton(t[inr], lp[inr] * np.log(10), *fns, tv[0], tv[-1])
+
+        t = _policy(t, out, policy)
+        return _out(t.reshape(p.shape))
+
+    # Equations of state available for this species, in order of preference
+    def eos_list(self):
+        if "eos" not in self._tables:
+            self._tables["eos"] = [prefix for prefix in ("aqua", "cms19", "vdw")
+                                    if self.has(prefix+"_rho")]
+        return self._tables["eos"]
+
+    # Bilinear interpolation of log rho in (T, log P), at flat arrays t [K]
+    #    and lp [log10 Pa]. Also returns a mask of the points outside the table.
+    def _logrho(self, t, lp, eos:str=None):
+        if eos is None:
+            avail = self.eos_list()
+            if len(avail) == 0:
+                raise Exception("No EOS for %s"%self.gas)
+            eos = avail[0]
+        taxis, paxis, z = self._table2d(eos)
+
+        it, wt, ot = taxis.locate(t)
+        ip, wp, op = paxis.locate(lp)
+
+        z0 = z[ip, it] + wt * (z[ip, it+1] - z[ip, it])
+        z1 = z[ip+1, it] + wt * (z[ip+1, it+1] - z[ip+1, it])
+        return z0 + wp * (z1 - z0), ot | op
+
+    # Density [kg m-3] at temperature t [K] and pressure p [Pa]
+    #    Bilinear interpolation of log rho in (T, log P). By default, uses
+    #    the first available of 'aqua', 'cms19' and 'vdw'.
+    def rho(self, t, p, eos:str=None, policy:str="clamp"):
+        t, p = np.broadcast_arrays(np.asarray(t, dtype=float), np.asarray(p, dtype=float))
+        shape = t.shape
+        v, out = self._logrho(t.ravel(), np.log10(p.ravel()), eos)
+        v = _policy(v, out, policy)
+        return _out(10.0 ** v.reshape(shape))
+
+# Species lookup tables, from the LRU cache
+def species(gas:str):
+    if gas in _cache:
+        _cache.move_to_end(gas)
+        return _cache[gas]
+
+    sp = Species(gas, _source["path"])
+    _cache[gas] = sp
+    while len(_cache) > maxsize:
+        _cache.popitem(last=False)
+    return sp
+
+def psat(t, gas:str, policy:str="clamp"):
+    return species(gas).psat(t, policy=policy)
+
+def latent_heat(t, gas:str, policy:str="clamp"):
+    return species(gas).latent_heat(t, policy=policy)
+
+def cp(t, gas:str, policy:str="clamp"):
+    return species(gas).cp(t, policy=policy)
+
+def enthalpy(t, gas:str, policy:str="clamp"):
+    return species(gas).enthalpy(t, policy=policy)
+
+def entropy(t, gas:str, policy:str="clamp"):
+    return species(gas).entropy(t, policy=policy)
+
+def gibbs(t, gas:str, policy:str="clamp"):
+    return species(gas).gibbs(t, policy=policy)
+
+# Density [kg m-3] of mixtures of gases at temperature t [K] and pressure p [Pa]
+#    x holds the mole fraction of each of gases, with shape (len(gases),) +
+#    t.shape, and is normalised to sum to one at each point. Mixing rules:
+#       'additive' : the volumes of the pure species at (T, P) add (Amagat's
+#                    law), so 1/rho is the sum of y_k/rho_k over the mass
+#                    fractions y_k
+#       'ideal'    : ideal gas at the mean molecular weight
+#    Under 'additive', fallback sets the density of a species outside its
+#    table, or without an EOS: 'ideal' uses the pure species as an ideal gas,
+#    'clamp' holds the table at its edge, and 'nan' returns NaN. eos can map
+#    gases to the EOS used for each, as in rho. Points are evaluated in
+#    chunks, so the temporary arrays stay small.
+def mixture_rho(t, p, x, gases:list, rule:str="additive", fallback:str="ideal",
+                    eos:dict=None, chunk:int=1000000):
+    if rule not in ("additive", "ideal"):
+        raise Exception("Unknown mixing rule %s"%rule)
+    if fallback not in ("ideal", "clamp", "nan"):
+        raise Exception("Unknown fallback %s"%fallback)
+    if eos is None:
+        eos = {}
+
+    t, p = np.broadcast_arrays(np.asarray(t, dtype=float), np.asarray(p, dtype=float))
+    shape = t.shape
+    x = np.broadcast_to(np.asarray(x, dtype=float), (len(gases),) + shape)
+
+    tf = t.ravel()
+    pf = p.ravel()
+    xf = x.reshape(len(gases), -1)
+    n = len(tf)
+
+    sps = [species(gas) for gas in gases]
+    mmw = np.array([sp.mmw() for sp in sps])
+    tabled = [(gas in eos) or (len(sp.eos_list()) > 0) for gas, sp in zip(gases, sps)]
+    for gas, ok in zip(gases, tabled):
+        if (rule == "additive") and (not ok) and (fallback != "ideal"):
+            raise Exception("No EOS for %s"%gas)
+
+    out = np.empty(n)
+    for i0 in range(0, n, chunk):
+        sl = slice(i0, i0 + chunk)
+        tc, pc, xc = tf[sl], pf[sl], xf[:, sl]
+
+        # mass per mole of mixture [kg mol-1], before normalising x
+        mass = mmw @ xc
+
+        if rule == "ideal":
+            out[sl] = pc * mass / (Rgas * tc * np.sum(xc, axis=0))
+            continue
+
+        # volume per mole of mixture [m3 mol-1], before normalising x
+        vol = np.zeros(len(tc))
+        lp = np.log10(pc)
+        for k, sp in enumerate(sps):
+            if not np.any(xc[k] > 0):
+                continue
+            ideal = Rgas * tc / pc
+            if not tabled[k]:
+                vk = ideal
+            else:
+                v, o = sp._logrho(tc, lp, eos.get(gases[k]))
+                vk = mmw[k] / 10.0 ** v
+                match fallback:
+                    case "ideal":
+                        vk = np.where(o, ideal, vk)
+                    case "nan":
+                        vk[o] = np.nan
+            vol += np.where(xc[k] > 0, xc[k] * vk, 0.0)
+
+        out[sl] = mass / vol
+
+    return _out(out.reshape(shape))
+
+# Saturation temperature [K] for each of gases, at pressures p [Pa]
+#    Returns an array with shape (len(gases),) + p.shape
+def tsat(p, gases:list, polish:bool=True, policy:str="clamp"):
+    p = np.asarray(p, dtype=float)
+    out = np.empty((len(gases),) + p.shape)
+    for k, gas in enumerate(gases):
+        out[k] = species(gas).tsat(p, polish=polish, policy=policy)
+    return out
+
+def rho(t, p, gas:str, eos:str=None, policy:str="clamp"):
+    return species(gas).rho(t, p, eos=eos, policy=policy)
+
+# Saturation and condensation diagnostic over atmospheric columns
+#    t [K] and p [Pa] are arrays of any shape, typically (n_profiles, n_levels),
+#    and pp [Pa] holds the partial pressure of each of gases, with shape
+#    (len(gases),) + t.shape. Returns a dict of arrays with that shape:
+#       'S'    : saturation ratio pp/psat
+#       'mask' : condensable, i.e. S > 1 within the range of the curve
+#       'L'    : latent heat at t [J kg-1], NaN where there is no data
+#       'dx'   : mole fraction of the layer in excess of saturation
+#       'Q'    : latent heat released if the excess condenses [J m-3]
+#    Levels are evaluated in chunks of at most chunk elements, so that the
+#    temporary arrays stay small. Below the saturation curve's lowest
+#    temperature psat is not known, so S, dx and Q are NaN and mask is
+#    False there; holding psat at its value at the bottom of the curve would
+#    overstate it by orders of magnitude, and hide condensation.
+def saturation(t, p, pp, gases:list, chunk:int=1000000):
+    t, p = np.broadcast_arrays(np.asarray(t, dtype=float), np.asarray(p, dtype=float))
+    shape = (len(gases),) + t.shape
+    pp = np.broadcast_to(np.asarray(pp, dtype=float), shape)
+
+    tf = t.ravel()
+    pf = p.ravel()
+    ppf = pp.reshape(len(gases), -1)
+    n = len(tf)
+
+    out = {k:np.empty((len(gases), n)) for k in ("S", "L", "dx", "Q")}
+    out["mask"] = np.empty((len(gases), n), dtype=bool)
+
+    for k, gas in enumerate(gases):
+        sp = species(gas)
+        ax = sp._table1d("sat_T", "sat_P")[0]
+        t_bot, t_top = ax.x[0], ax.x[-1]
+        has_lat = sp.has("lat_H")
+        mmw = sp.mmw()
+
+        for i0 in range(0, n, chunk):
+            sl = slice(i0, i0 + chunk)
+            tc, pc, ppc = tf[sl], pf[sl], ppf[k, sl]
+
+            ps = sp.psat(tc)
+            below = tc < t_bot
+            S = np.where(below, np.nan, ppc / ps)
+            m = (S > 1) & (tc <= t_top)
+            excess = np.where(m, ppc - ps, np.where(below, np.nan, 0.0))
+
+            if has_lat:
+                L = sp.latent_heat(tc)
+            else:
+                L = np.full(tc.shape, np.nan)
+
+            out["S"][k, sl] = S
+            out["mask"][k, sl] = m
+            out["L"][k, sl] = L
+            out["dx"][k, sl] = excess / pc
+            out["Q"][k, sl] = L * mmw * excess / (Rgas * tc)
+
+    return {k:v.reshape(shape) for k,v in out.items()}
@@ -0,0 +1,112 @@
+# Temperature grids for the 1D tables
+#    Modes:
+#       'uniform'  : the grid t given by the stage, which is uniformly spaced
+#       'adaptive' : starts from a coarse grid over the same range, and
+#                    bisects each interval where linear interpolation at its
+#                    midpoint differs from f by more than tol, until the
+#                    intervals reach the spacing of the uniform grid
+#    The stages default to 'uniform', which query looks up by index
+#    arithmetic; 'adaptive' tables are smaller, but need a binary search.
+#    Errors are measured as the consumers of each table interpolate it:
+#       'log' : absolute error in log10 f, for saturation pressures
+#       'rel' : error relative to |f|, for latent heats and heat capacities
+
+import os
+import json
+import numpy as np
+
+modes = ("uniform", "adaptive")
+
+# Values in the space where the error is measured
+def _scaled(y, scale:str):
+    match scale:
+        case "log":
+            return np.log10(np.maximum(y, 1e-300))
+        case "rel":
+            return y
+        case _:
+            raise Exception("Unknown error scale %s"%scale)
+
+# Error of linear interpolation at the midpoint of each interval
+def _midpoint_error(ym, lin, scale:str):
+    if scale == "log":
+        return np.abs(ym - lin)
+    return np.abs(ym - lin) / np.maximum(np.abs(ym), 1e-300)
+
+# Midpoint error of linear interpolation over each interval of the grid t
+def grid_error(f, t, y, scale:str):
+    tm = 0.5 * (t[:-1] + t[1:])
+    ys = _scaled(y, scale)
+    return _midpoint_error(_scaled(f(tm), scale), 0.5 * (ys[:-1] + ys[1:]), scale)
+
+# Adaptive grid for f between tmin and tmax
+#    breaks are points which are always in the grid (e.g. a triple point).
+#    Intervals are split until they are no wider than dt_min, so the grid
+#    is never coarser than a uniform grid of spacing dt_min where f is not
+#    resolved to tol. Returns the grid and f on it.
+def adaptive(f, tmin:float, tmax:float, tol:float, scale:str="log",
+                dt_min:float=0.1, breaks=(), n0:int=64, max_iter:int=40):
+
+    t = np.linspace(tmin, tmax, n0+1)
+    extra = [b for b in breaks if tmin < b < tmax]
+    t = np.unique(np.concatenate((t, extra)))
+    y = np.asarray(f(t), dtype=float)
+
+    for _ in range(max_iter):
+        tm = 0.5 * (t[:-1] + t[1:])
+        ym = np.asarray(f(tm), dtype=float)
+        ys = _scaled(y, scale)
+        e  = _midpoint_error(_scaled(ym, scale), 0.5 * (ys[:-1] + ys[1:]), scale)
+
+        split = (e > tol) & (np.diff(t) > dt_min * (1 + 1e-9))
+        if not np.any(split):
+            break
+
+        # insert the midpoints of the intervals which are split
+        t = np.concatenate((t, tm[split]))
+        y = np.concatenate((y, ym[split]))
+        order = np.argsort(t, kind='stable')
+        t = t[order]
+        y = y[order]
+
+    return t, y
+
+# Tabulate f, on the uniform grid t or adaptively over its range
+#    Returns the grid, f on the grid, and a dict recording the mode,
+#    tolerance, number of points, the achieved (maximum) midpoint error and
+#    the number of intervals above tol. Intervals can only stay above tol at
+#    kinks or discontinuities in f, where they are limited by the spacing
+#    of the uniform grid.
+def tabulate(f, t, mode:str="uniform", tol:float=1e-4, scale:str="log", breaks=()):
+    t = np.asarray(t, dtype=float)
+
+    match mode:
+        case "uniform":
+            y = np.asarray(f(t), dtype=float)
+        case "adaptive":
+            if len(t) > 2:
+                dt = float(t[1] - t[0])
+                t, y = adaptive(f, t[0], t[-1], tol, scale=scale, dt_min=dt, breaks=breaks)
+            else:
+                y = np.asarray(f(t), dtype=float)
+        case _:
+            raise Exception("Unknown grid mode %s"%mode)
+
+    e = grid_error(f, t, y, scale)
+    info = {
+        "mode"  : mode,
+        "scale" : scale,
+        "tol"   : tol,
+        "n"     : len(t),
+        "T_min" : float(t[0]),
+        "T_max" : float(t[-1]),
+        "error" : float(np.amax(e)) if len(e) > 0 else 0.0,
+        "n_over": int(np.count_nonzero(e > tol)),
+    }
+    return t, y, info
+
+# Write the grid information for each table of a stage to JSON
+def write_info(fpath:str, info:dict):
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'w') as hdl:
+        json.dump(info, hdl, indent=1, sort_keys=True)
@@ -0,0 +1,102 @@
+# Storage of generated tables
+#    Tables are written under get_gendir() by each stage, and are addressed
+#    by their path without an extension. They are stored column-major, with
+#    shape (ncol, nrow), so that each column is contiguous on disk. The
+#    default format is NumPy's binary .npy, which can be memory-mapped;
+#    CSV is available for export and for reading older outputs.
+
+import os
+import glob
+import numpy as np
+
+formats = ("npy", "csv")
+default_format = "npy"
+
+# Path to the file holding a table, or None if it does not exist
+def find(fpath:str):
+    for fmt in formats:
+        p = fpath + "." + fmt
+        if os.path.exists(p):
+            return p
+    return None
+
+# Check if a table exists in any format
+def exists(fpath:str):
+    return find(fpath) is not None
+
+# List tables in a directory, returning paths without extensions
+def list_tables(dirpath:str, pattern:str="*"):
+    out = set()
+    for fmt in formats:
+        for f in glob.glob(os.path.join(dirpath, pattern + "." + fmt)):
+            out.add(os.path.splitext(f)[0])
+    return sorted(out)
+
+# Write a table from a list of equal-length columns
+#    The header is only stored in CSV files.
+def write_table(fpath:str, columns, header:str="", fmt:str=None):
+    if fmt is None:
+        fmt = default_format
+    data = np.array(columns, dtype=float, ndmin=2)
+
+    # remove copies in other formats, so readers see a single table
+    for f in formats:
+        if os.path.exists(fpath + "." + f):
+            os.remove(fpath + "." + f)
+
+    match fmt:
+        case "npy":
+            np.save(fpath + ".npy", data)
+        case "csv":
+            np.savetxt(fpath + ".csv", data.T, fmt="%.9e", delimiter=',', header=header)
+        case _:
+            raise Exception("Unknown table format %s"%fmt)
+    return fpath + "." + fmt
+
+# Read a table, returning an array with shape (ncol, nrow)
+#    Binary tables are memory-mapped unless mmap is False, so that slices
+#    only load the parts of the file which are accessed.
+def read_table(fpath:str, mmap:bool=True):
+    p = find(fpath)
+    if p is None:
+        raise FileNotFoundError("Table not found: %s"%fpath)
+    if p.endswith(".npy"):
+        return np.load(p, mmap_mode='r' if mmap else None)
+    return np.array(np.loadtxt(p, delimiter=',', ndmin=2).T)
+
+# Export a table to CSV alongside the original
+def export_csv(fpath:str, header:str=""):
+    data = read_table(fpath)
+    p = fpath + ".csv"
+    np.savetxt(p, np.transpose(data), fmt="%.9e", delimiter=',', header=header)
+    return p
+
+# Columns of a table with the first column between tmin and tmax
+#    The first column must be sorted, as for the 1D tables of each stage.
+def slice_range(data, tmin:float, tmax:float):
+    i0 = np.searchsorted(data[0], tmin, side='left')
+    i1 = np.searchsorted(data[0], tmax, side='right')
+    return data[:, i0:i1]
+
+# Axes and values of a gridded table
+#    Grid tables have columns (T, log P, z) with T varying fastest, as
+#    written from a meshgrid. Returns the T and P axes and z with shape
+#    (nP, nT), all of which are views into the table.
+def as_grid(data):
+    # find where P first changes, reading only as much as needed
+    n = 1024
+    while True:
+        w = data[1][:n]
+        i = np.flatnonzero(w != w[0])
+        if len(i) > 0:
+            nt = i[0]
+            break
+        if n >= len(data[1]):
+            nt = len(data[1])
+            break
+        n *= 2
+
+    t = data[0][:nt]
+    p = data[1][::nt]
+    z = np.reshape(data[2], (len(p), nt))
+    return t, p, z
@@ -2,7 +2,12 @@ import tarfile
 import zipfile
 import requests
 import os
+import json
+import shutil
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from thermotools import get_gendir
 
 # Calculate the checksum of a file using the BLAKE2b algorithm
 def checksum(filename:str):
@@ -20,16 +25,172 @@ def writesum(filename:str):
     with open(chkpath, "w") as hdl:
        hdl.write("%s \n"%checksum(filename))
 
-# https://stackoverflow.com/a/53101953
+# Downloads
+#    Files are fetched through a shared session, so connections are reused,
+#    and are kept in a content-addressed cache under get_cachedir(). Each
+#    URL is stored under the hash of the URL, with a record of its checksum
+#    which is verified before the cached copy is used. URLs which do not
+#    exist (404/410) are also recorded, so reruns need no network access.
+#    Interrupted downloads are resumed with an HTTP Range request. Files
+#    are copied out of the cache to their destination, or hard-linked with
+#    link=True to save space; a linked file shares its data with the cache,
+#    so it must not be modified in place.
+
+def get_cachedir():
+    return os.path.join(get_gendir(), "cache", "web")
+
+_sessions = {}
+
+# Session with a connection pool of the given size
+def get_session(pool:int=16):
+    if pool not in _sessions:
+        s = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        _sessions[pool] = s
+    return _sessions[pool]
+
+def _cache_path(url:str):
+    key = hashlib.blake2b(url.encode(), digest_size=20).hexdigest()
+    return os.path.join(get_cachedir(), key)
+
+def _read_record(cpath:str):
+    if not os.path.exists(cpath + ".json"):
+        return None
+    with open(cpath + ".json", 'r') as hdl:
+        return json.load(hdl)
+
+def _write_record(cpath:str, rec:dict):
+    with open(cpath + ".json.tmp", 'w') as hdl:
+        json.dump(rec, hdl, indent=1)
+    os.replace(cpath + ".json.tmp", cpath + ".json")
+
+# Place a cached file at fpath, as a copy or, with link, a hard link
+#    Falls back to a copy where the cache and fpath are on different devices.
+def _place(cpath:str, fpath:str, link:bool=False):
+    if os.path.abspath(cpath) == os.path.abspath(fpath):
+        return
+    if os.path.exists(fpath):
+        os.remove(fpath)
+    os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+    if link:
+        try:
+            os.link(cpath, fpath)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(cpath, fpath)
+
+# Fetch a URL into the cache, and optionally copy (or link) it to fpath
+#    Returns the path to the file, or None if the URL does not exist.
+#    If expect is given, the checksum of the file must match it.
+def fetch(url:str, fpath:str=None, expect:str=None, session=None,
+            timeout:float=60, chunk:int=1048576, link:bool=False):
+    cpath = _cache_path(url)
+    os.makedirs(get_cachedir(), exist_ok=True)
+
+    # use the cached copy if it is intact
+    rec = _read_record(cpath)
+    if rec is not None:
+        if rec["status"] in (404, 410):
+            return None
+        if os.path.exists(cpath) and (checksum(cpath) == rec["checksum"]):
+            if (expect is not None) and (rec["checksum"] != expect):
+                raise Exception("Checksum mismatch for %s"%url)
+            if fpath is None:
+                return cpath
+            _place(cpath, fpath, link)
+            return fpath
+
+    if session is None:
+        session = get_session()
+
+    # resume a partial download
+    part = cpath + ".part"
+    headers = {}
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset > 0:
+        headers["Range"] = "bytes=%d-"%offset
+
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as r:
+        if r.status_code in (404, 410):
+            _write_record(cpath, {"url":url, "status":r.status_code})
+            return None
+        if r.status_code != 416:  # 416: the partial file is already complete
+            r.raise_for_status()
+            # servers which ignore the Range send the whole file (200)
+            mode = 'ab' if r.status_code == 206 else 'wb'
+            if (mode == 'ab') and (not r.headers.get("Content-Range", "").startswith("bytes %d-"%offset)):
+                os.remove(part)
+                raise Exception("Unexpected range %s for %s"%(r.headers.get("Content-Range"), url))
+            with open(part, mode) as hdl:
+                for data in r.iter_content(chunk_size=chunk):
+                    hdl.write(data)
+
+    os.replace(part, cpath)
+    rec = {"url":url, "status":200, "checksum":checksum(cpath), "size":os.path.getsize(cpath)}
+    if (expect is not None) and (rec["checksum"] != expect):
+        os.remove(cpath)
+        raise Exception("Checksum mismatch for %s"%url)
+    _write_record(cpath, rec)
+
+    if fpath is None:
+        return cpath
+    _place(cpath, fpath, link)
+    return fpath
+
+# Download a file from url to fpath, through the cache
 def download(url, fpath):
     print("Download file from "+url)
-    r = requests.get(url, stream=True)
-    with open(fpath, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk: # filter out keep-alive new chunks
-                f.write(chunk)
+    if fetch(url, fpath) is None:
+        raise Exception("File not found: %s"%url)
     print("    Done")
 
+def _fetch_safe(url:str, fpath:str, session, timeout:float, link:bool):
+    try:
+        return fetch(url, fpath, None, session, timeout, link=link), None
+    except Exception as e:
+        return None, str(e)
+
+# Fetch many URLs concurrently, with at most nworkers at once
+#    fpaths may be None, to leave the files in the cache. Returns the path
+#    for each URL, or None where the URL does not exist or could not be
+#    fetched, and a dict of the error for each URL which could not be
+#    fetched. Failures are not cached, so they are tried again next time,
+#    and are summarised at the end if report is True. link is passed on to
+#    fetch.
+def fetch_many(urls:list, fpaths:list=None, nworkers:int=16, timeout:float=60,
+                report:bool=True, link:bool=False):
+    if fpaths is None:
+        fpaths = [None] * len(urls)
+    session = get_session(nworkers)
+
+    # each URL is only fetched once
+    first = {}
+    for i, u in enumerate(urls):
+        first.setdefault(u, i)
+
+    with ThreadPoolExecutor(nworkers) as ex:
+        futures = {u:ex.submit(_fetch_safe, u, fpaths[i], session, timeout, link) for u,i in first.items()}
+        results = {u:fut.result() for u,fut in futures.items()}
+    out = [results[u][0] for u in urls]
+    failed = {u:res[1] for u,res in results.items() if res[1] is not None}
+
+    # duplicated URLs with their own destinations
+    for i, u in enumerate(urls):
+        if (i != first[u]) and (fpaths[i] is not None) and (out[i] is not None):
+            _place(_cache_path(u), fpaths[i], link)
+            out[i] = fpaths[i]
+
+    if report and (len(failed) > 0):
+        print("Failed to fetch %d of %d URLs:"%(len(failed), len(first)))
+        for u in list(failed)[:10]:
+            print("    %s: %s"%(u, failed[u]))
+        if len(failed) > 10:
+            print("    ...")
+    return out, failed
+
 def untar(fpath, dpath):
     print("Untarring "+fpath)
     with tarfile.open(fpath)  as hdl:
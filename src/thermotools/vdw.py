@@ -0,0 +1,145 @@
+# Van der Waals equation of state
+# Based on code originally written by Claire Guimond
+# https://scipython.com/book/chapter-6-numpy/problems/p64/the-van-der-waals-equation-of-state/
+
+import numpy as np
+
+from thermotools import Rgas
+
+# Van Der Waals coefficients
+#    From Wikipedia data page.
+#    https://en.wikipedia.org/wiki/Van_der_Waals_constants_(data_page)
+#    Units: bars, moles/litre
+coeffs = {
+    "NH3"    : (4.225   ,  0.0371),
+    "Ar"     : (1.355   ,  0.03201),
+    "C4H10"  : (14.66   ,  0.1226),
+    "CO2"    : (3.640   ,  0.04267),
+    "CS2"    : (11.77   ,  0.07685),
+    "CO"     : (1.505   ,  0.0398500),
+    "CCl4"   : (19.7483 ,  0.1281),
+    "Cl"     : (6.579   ,  0.05622),
+    "C2N2"   : (7.769   ,  0.06901),
+    "C4H10O" : (17.61   ,  0.1344),
+    "CH3SCH3": (13.04   ,  0.09213),
+    "C2H6"   : (5.562   ,  0.0638),
+    "C2H5OH" : (12.18   ,  0.08407),
+    "F"      : (1.171   ,  0.0290),
+    "He"     : (0.0346  ,  0.0238),
+    "N2H4"   : (8.46    ,  0.0462),
+    "H2"     : (0.2476  ,  0.02661),
+    "HBr"    : (4.510   ,  0.04431),
+    "HCl"    : (3.716   ,  0.04081),
+    "HCN"    : (11.29   ,  0.0881),
+    "HF"     : (9.565   ,  0.0739),
+    "HI"     : (6.309   ,  0.0530),
+    "H2Se"   : (5.338   ,  0.04637),
+    "H2S"    : (4.490   ,  0.04287),
+    "C4H10"  : (13.32   ,  0.1164),
+    "Kr"     : (2.349   ,  0.03978),
+    "Kr"     : (8.200   ,  0.01696),
+    "CH4"    : (2.253   ,  0.04278),
+    "CH4O"   : (9.649   ,  0.06702),
+    "Ne"     : (0.2135  ,  0.01709),
+    "NO"     : (1.358   ,  0.02789),
+    "N2"     : (1.370   ,  0.0387),
+    "NO2"    : (5.354   ,  0.04424),
+    "NF3"    : (3.58    ,  0.0545),
+    "N2O"    : (3.832   ,  0.04415),
+    "O2"     : (1.382   ,  0.03186),
+    "O3"     : (3.570   ,  0.0487),
+    "PH3"    : (4.692   ,  0.05156),
+    "SiH4"   : (4.377   ,  0.05786),
+    "SO2"    : (6.803   ,  0.05636),
+    "SF6"    : (7.857   ,  0.0879),
+    "CCl4"   : (20.01   ,  0.1281),
+    "H2O"    : (5.536   ,  0.03049),
+    "Xe"     : (4.250   ,  0.05105),
+}
+
+# function to convert coefficients to SI
+def coeff_SI(a, b):
+    # Convert coefficients to SI
+    a_SI = a / 1.e6 * 1.e5  # m^6.Pa.mol^-2
+    b_SI = b / 1.e3  # m^3.mol^-1
+    return a_SI, b_SI
+
+# all of the coefficients in SI
+coeffs_SI = {k:coeff_SI(*v) for k,v in coeffs.items()}
+
+def rho_ideal(M, T, p):
+    # SI units
+    # ideal gas density in kg/m3
+    return p * M / (Rgas * T)
+
+def calc_critical_point(a, b):
+    # SI units
+    # https://www.thermopedia.com/content/1232/
+    Tc = 8*a / (27*Rgas*b)
+    pc = a / (27*b**2)
+    return pc, Tc
+
+# Largest real root of V^3 + A V^2 + B V + C = 0, elementwise
+#    Closed-form solution of the depressed cubic, using the trigonometric
+#    form where there are three real roots and Cardano's formula otherwise,
+#    followed by Newton iterations to polish the root to machine precision.
+def cubic_max_root(A, B, C, newton=3):
+    A, B, C = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (A,B,C)])
+
+    # depressed cubic y^3 + p y + q = 0, with V = y - A/3
+    s = A / 3.0
+    p = B - A * s
+    q = (2.0 * s * s - B) * s + C
+    disc = (q/2.0)**2 + (p/3.0)**3
+
+    y = np.empty(A.shape)
+
+    # three real roots (p < 0)
+    three = disc < 0
+    m = 2.0 * np.sqrt(-p[three] / 3.0)
+    arg = np.clip(3.0 * q[three] / (p[three] * m), -1.0, 1.0)
+    y[three] = m * np.cos(np.arccos(arg) / 3.0)
+
+    # one real root
+    one = ~three
+    sq = np.sqrt(disc[one])
+    u = np.cbrt(-q[one]/2.0 - np.copysign(sq, q[one]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y[one] = np.where(u == 0, 0.0, u - p[one] / (3.0 * u))
+
+    # polish, only accepting steps which reduce the residual
+    #    (near the critical point the root is nearly triple and df ~ 0)
+    def _f(V):
+        return ((V + A) * V + B) * V + C
+
+    V = y - s
+    f = _f(V)
+    for _ in range(newton):
+        df = (3.0 * V + 2.0 * A) * V + B
+        with np.errstate(divide='ignore', invalid='ignore'):
+            V_new = V - f / df
+        f_new = _f(V_new)
+        better = np.abs(f_new) < np.abs(f)
+        V = np.where(better, V_new, V)
+        f = np.where(better, f_new, f)
+
+    return V
+
+def rho_VDW(a, b, M, T, p):
+    """
+    Evaluate density using Van der Waals equation of state.
+        Input a and b in SI units, T in K, p in Pa, M in kg/mol.
+        T and p may be arrays, which are broadcast against each other.
+        Returns density in kg/m3, taking the gas branch (largest volume)
+        where there are three real roots.
+    """
+    T = np.asarray(T, dtype=float)
+    p = np.asarray(p, dtype=float)
+
+    # p V^3 - (p b + R T) V^2 + a V - a b = 0, normalised by p
+    A = -(b + Rgas * T / p)
+    B = a / p
+    C = -a * b / p
+
+    Vgas = cubic_max_root(A, B, C)  # in m3/mol
+    return M / Vgas  # kg/m3
@@ -5,7 +5,8 @@
 # https://www.sciencedirect.com/science/article/pii/S0016703706020461
 
 import numpy as np
-from scipy.interpolate import PchipInterpolator
+
+from thermotools import interp
 
 # Coefficients
 _a1 = -7.85951783
@@ -45,92 +46,136 @@ mmw = 0.018015  # kg/mol
 big_number = 1e99
 
 # Functions 
-
-# saturation pressure (gas phase) [Pa]
-def psat_liquid(t:float):
-
-    if t < T_trip:
-        raise Exception("Evaluation of liquid psat inside solid region")
-    
+#    All functions accept scalars or arrays of temperature [K]. Arrays are
+#    evaluated elementwise with the phase selected by masking, and scalar
+#    input returns a scalar.
+
+# return a scalar for 0-d results
+def _out(x):
+    x = np.asarray(x)
+    if x.ndim == 0:
+        return x[()]
+    return x
+
+# saturation pressure (gas phase) [Pa], without range check
+def _psat_liquid(t):
     t_c = 647.096
     p_c = 22.064 * 1.0e6 # Pa
 
     q = 1 - t/t_c
 
     rhs = (t_c/t) * (_a1*q + _a2*q**1.5 + _a3*q**3 + _a4*q**3.5 + _a5*q**4 + _a6*q**7.5)
-    out = np.exp(rhs) * p_c
-    return out 
-
-# saturation pressure (solid phase) [Pa]
-def psat_solid(t:float):
+    return np.exp(rhs) * p_c
 
-    if t > T_trip:
-        raise Exception("Evaluation of solid psat inside liquid region")
-    
-    t = max(t, 20)
+# saturation pressure (solid phase) [Pa], without range check
+def _psat_solid(t):
+    t = np.maximum(t, 20)
 
     t_n = 273.16 # K
     p_n = 0.000611657 * 1e6  # Pa
 
     theta = t/t_n 
     rhs = -13.928169*(1-theta**(-1.5)) + 34.7078238*(1-theta**(-1.25))
-    out = np.exp(rhs) * p_n
-    return out 
+    return np.exp(rhs) * p_n
 
+# saturation pressure (gas phase) [Pa]
+def psat_liquid(t):
+    t = np.asarray(t, dtype=float)
 
-# saturation pressure (either phase) [Pa]
-def psat_both(t:float):
+    if np.any(t < T_trip):
+        raise Exception("Evaluation of liquid psat inside solid region")
 
-    if t > T_crit:
-        return big_number
-    
-    if t > T_trip:
-        return psat_liquid(t)
-    else:
-        return psat_solid(t)
+    return _out(_psat_liquid(t))
+
+# saturation pressure (solid phase) [Pa]
+def psat_solid(t):
+    t = np.asarray(t, dtype=float)
+
+    if np.any(t > T_trip):
+        raise Exception("Evaluation of solid psat inside liquid region")
+
+    return _out(_psat_solid(t))
+
+
+# saturation pressure (either phase) [Pa]
+def psat_both(t):
+    t = np.asarray(t, dtype=float)
+
+    crit = t > T_crit
+    liq  = (t > T_trip) & ~crit
+    sol  = ~(t > T_trip)
+
+    out = np.empty(t.shape)
+    out[crit] = big_number
+    out[liq]  = _psat_liquid(t[liq])
+    out[sol]  = _psat_solid(t[sol])
+    return _out(out)
     
 
 # derivative of saturation pressure
-def dpsat_dt(t:float):
-    
-    psat = psat_both(t)
+#    zero above the critical point, where psat_both is constant
+def dpsat_dt(t):
+    t = np.asarray(t, dtype=float)
+
+    sub = ~(t > T_crit)
+    ts = t[sub]
+    psat = psat_both(ts)
 
-    q = 1 - t/T_crit
+    q = 1 - ts/T_crit
 
     paren = np.log(psat/P_crit) + _a1 + 1.5*_a2*q**0.5 + 3*_a3*q**2 + 3.5*_a4*q**2.5 + 4*_a5*q**3 + 7.5*_a6*q**6.5
-    out = -1.0 * (psat/t) * paren 
-    return out 
+
+    out = np.zeros(t.shape)
+    out[sub] = -1.0 * (psat/ts) * paren 
+    return _out(out)
+
+# derivative of psat_both [Pa/K]
+#    as dpsat_dt, but following the sublimation curve at or below T_trip
+def dpsat_both_dt(t):
+    t = np.asarray(t, dtype=float)
+
+    sol = ~(t > T_trip)
+    out = np.empty(t.shape)
+    out[~sol] = dpsat_dt(t[~sol])
+
+    # d/dt of ln psat for _psat_solid, which is flat below 20 K
+    ts = t[sol]
+    theta = np.maximum(ts, 20)/273.16
+    dlnp = (13.928169*(-1.5)*theta**(-2.5) + 34.7078238*1.25*theta**(-2.25)) / 273.16
+    out[sol] = np.where(ts > 20, _psat_solid(ts) * dlnp, 0.0)
+    return _out(out)
 
 # density of liquid
 def rho_liq(t):
-    q = 1 - t/T_crit
+    q = 1 - np.asarray(t, dtype=float)/T_crit
 
     rhs = 1 + _b1*q**(1/3.0) + _b2*q**(2/3.0) + _b3*q**(5/3.0) + _b4*q**(16/3.0) + _b5*q**(43/3.0) + _b6*q**(110/3.0)
     out = rhs * rho_crit 
-    return out 
+    return _out(out)
 
 # density of vapour
 def rho_vap(t):
-    q = 1 - t/T_crit
+    q = 1 - np.asarray(t, dtype=float)/T_crit
 
     rhs = _c1 * q**(2/6.0) + _c2*q**(4/6.0) + _c3*q**(8/6.0) + _c4*q**(18/6.0) + _c5*q**(37/6) + _c6*q**(71/6)
     out = np.exp(rhs) * rho_crit 
-    return out 
+    return _out(out)
 
 
 # enthalpy of phase change [J/kg]
 def delta_vap(t):
+    t = np.asarray(t, dtype=float)
 
-    if t >= T_crit:
-        return 0.0
+    sub = ~(t >= T_crit)
+    ts = t[sub]
 
-    dpdt = dpsat_dt(t)
-    h_liq = 1.0e-6 * 1e3 * t / rho_liq(t) 
-    h_vap = 1.0e-6 * 1e3 * t / rho_vap(t)
+    dpdt = dpsat_dt(ts)
+    h_liq = 1.0e-6 * 1e3 * ts / rho_liq(ts) 
+    h_vap = 1.0e-6 * 1e3 * ts / rho_vap(ts)
 
-    out = dpdt * (h_vap - h_liq) * 1e3 
-
-    return out 
+    out = np.zeros(t.shape)
+    out[sub] = dpdt * (h_vap - h_liq) * 1e3 
+    return _out(out)
 
 # sublimation data [K, kJ/kg]
 tab_sublim = [  [T_trip , 2834.4],  # set to T_trip for numerics
@@ -192,13 +237,17 @@ tab_sublim = [  [T_trip , 2834.4],  # set to T_trip for numerics
 
 tab_sublim = np.array(tab_sublim)[::-1].T
 
-def delta_sub(t:float):
-    itp = PchipInterpolator(tab_sublim[0], tab_sublim[1])
-    return itp(t) * 1.0e3
+# enthalpy of sublimation [J/kg], interpolator is built on first use
+def delta_sub(t):
+    return _out(interp.pchip(tab_sublim)(t) * 1.0e3)
     
 
-def delta_both(t:float):
-    if t > T_trip:
-        return delta_vap(t)
-    else:
-        return delta_sub(t)
+def delta_both(t):
+    t = np.asarray(t, dtype=float)
+
+    vap = t > T_trip
+
+    out = np.empty(t.shape)
+    out[vap]  = delta_vap(t[vap])
+    out[~vap] = delta_sub(t[~vap])
+    return _out(out)
@@ -0,0 +1,24 @@
+import numpy as np
+
+from thermotools import interp
+
+# The registry drops the least recently used entries beyond maxsize
+def test_memoize_bounded(monkeypatch):
+    monkeypatch.setattr(interp, "maxsize", 4)
+    interp.clear()
+    for i in range(6):
+        interp.memoize(("k", i), lambda: i)
+    interp.memoize(("k", 2), lambda: None)
+    interp.memoize(("k", 6), lambda: 6)
+    assert list(interp._registry) == [("k", 4), ("k", 5), ("k", 2), ("k", 6)]
+    interp.clear()
+
+# A stale entry under a reused id is rebuilt for the new table
+def test_pchip_identity():
+    a = np.array([[0.0, 1.0, 2.0], [0.0, 1.0, 4.0]])
+    b = np.array([[0.0, 1.0, 2.0], [0.0, 2.0, 8.0]])
+    interp.clear()
+    interp._registry[("pchip", id(b))] = (a, interp.pchip(a))
+    assert interp.pchip(b)(1.0) == 2.0
+    assert interp.pchip(b) is interp.pchip(b)
+    interp.clear()
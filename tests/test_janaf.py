@@ -0,0 +1,35 @@
+import os
+import numpy as np
+
+from thermotools import janaf, store
+
+# JANAF table for H2O(g), rows from 0 to 2000 K
+fpath = os.path.join(os.path.dirname(__file__), "data", "H2O1.txt")
+
+def test_read_txt():
+    t, c, s, gef = janaf.read_txt(fpath)
+    assert t[0] == 0.0 and t[-1] == 2000.0
+    assert np.isnan(gef[0]) and np.all(np.isfinite(gef[1:]))
+    assert janaf.entropy_ref(t, s) == 188.834
+
+# S and -(G - H(T_ref))/T against the tabulated columns
+def test_integrals(tmp_path):
+    t_tab, _, s_tab, gef_tab = janaf.read_txt(fpath)
+    gas, outpath, _ = janaf.parse_txt(fpath, str(tmp_path), 0.5, 2000.05, 0.1, grid="uniform")
+    assert gas == "H2O"
+
+    t, c, s_out = store.read_table(outpath)
+    h, s, g = janaf.integrals(t, c, float(np.interp(janaf.T_ref, t, s_out)))
+    assert np.allclose(s, s_out)
+
+    # compare at the rows above the T = 0 placeholder
+    rows = t_tab >= 100.0
+    s_at = np.interp(t_tab[rows], t, s)
+    gef_at = -np.interp(t_tab[rows], t, g) / t_tab[rows]
+    assert np.max(np.abs(s_at - s_tab[rows])) < 0.01
+    assert np.max(np.abs(gef_at - gef_tab[rows])) < 0.01
+    assert abs(np.interp(janaf.T_ref, t, h)) < 1e-3
+
+    # H - H(T_ref) [kJ mol-1] against its column
+    h_tab = np.genfromtxt(fpath, delimiter="\t", skip_header=janaf.header_rows, usecols=4)
+    assert np.max(np.abs(np.interp(t_tab[rows], t, h) * 1e-3 - h_tab[rows])) < 0.01
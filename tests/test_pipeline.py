@@ -0,0 +1,14 @@
+from thermotools import pipeline
+
+# Module lists follow the imports of the notebooks and modules
+def test_stage_modules():
+    assert "interp.py" in pipeline.stage_modules("cp")
+    assert {"compile.py", "janaf.py", "sample.py", "interp.py"} <= set(pipeline.stage_modules("compile"))
+    assert "phase.py" in pipeline.stage_modules("vdw")
+    assert "pipeline.py" not in pipeline.stage_modules("compile")
+    for name in pipeline.stages:
+        assert "__init__.py" in pipeline.stage_modules(name)
+
+def test_imports():
+    src = "import os\nfrom thermotools import get_gendir, store\nimport thermotools.util\ndef f():\n    from thermotools.plot import plt\n"
+    assert pipeline._imports(src) == {"store.py", "util.py", "plot.py"}
@@ -0,0 +1,97 @@
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+from thermotools import query, phase, Rgas
+
+# Write a small compiled dataset for gas into directory d
+#    lp is the saturation curve [log10 Pa] on T = 100 to 200 K, and lat the
+#    latent heat [J kg-1], or None to leave it out
+def _write_species(d, gas:str, mmw:float=0.016, lp=None, lat=True):
+    t = np.linspace(100.0, 200.0, 101)
+    if lat is True:
+        lat = 5e5 - 1e3 * (t - 100.0)
+    if lp is None:
+        lp = 5.0 + 0.02 * (t - 100.0)
+    tg = np.linspace(100.0, 1000.0, 91)
+    pg = np.linspace(0.0, 8.0, 81)
+
+    with nc.Dataset(str(d / ("%s.nc"%gas)), 'w') as ds:
+        ds.createVariable("mmw", "f8")[:] = mmw
+        for dim, names, cols in (("sat", ("sat_T", "sat_P"), (t, lp)),
+                                    ("lat", ("lat_T", "lat_H"), (t, lat)),
+                                    ("cap", ("cap_T", "cap_C", "cap_H", "cap_S"),
+                                        (t, 2e3 + 0*t, 2e3 * (t - 100.0), 2e3 * np.log(t))),):
+            if any(c is None for c in cols):
+                continue
+            ds.createDimension(dim, len(t))
+            for n, c in zip(names, cols):
+                ds.createVariable(n, "f8", dim)[:] = c
+        ds.createDimension("vdw_T", len(tg))
+        ds.createDimension("vdw_P", len(pg))
+        ds.createVariable("vdw_T", "f8", "vdw_T")[:] = tg
+        ds.createVariable("vdw_P", "f8", "vdw_P")[:] = pg
+        T, P = np.meshgrid(tg, pg)
+        ds.createVariable("vdw_rho", "f8", ("vdw_P", "vdw_T"))[:] = np.log10(10**P * mmw / (Rgas * T))
+
+@pytest.fixture
+def source(tmp_path):
+    _write_species(tmp_path, "Xx")
+    query.set_source(str(tmp_path))
+    yield tmp_path
+    query.set_source(None)
+
+@pytest.mark.parametrize("policy", ["clamp", "nan", "raise"])
+def test_nan_inputs(source, policy):
+    t = np.array([150.0, np.nan, np.inf, 120.0])
+    p = np.array([1e6, 1e6, np.nan, 1e5])
+    sp = query.species("Xx")
+
+    for fn in (sp.psat, sp.latent_heat, sp.cp, sp.enthalpy, sp.entropy, sp.gibbs):
+        v = fn(t[[0,1,3]], policy=policy)
+        assert np.isnan(v[1]) and np.all(np.isfinite(v[[0,2]]))
+
+    v = sp.tsat(np.array([1e6, np.nan, -1.0]), policy=policy)
+    assert np.isfinite(v[0]) and np.all(np.isnan(v[1:]))
+
+    v = sp.rho(t, p, policy=policy)
+    assert np.all(np.isnan(v[1:3])) and np.all(np.isfinite(v[[0,3]]))
+
+    v = query.mixture_rho(t, p, np.ones((1, 4)), ["Xx"])
+    assert np.all(np.isnan(v[1:3])) and np.all(np.isfinite(v[[0,3]]))
+
+    out = query.saturation(t, p, 0.5 * p[None], ["Xx"])
+    assert np.all(np.isnan(out["S"][0, 1:3])) and not np.any(out["mask"][0, 1:3])
+
+# Clausius-Clapeyron gases are polished from the compiled data alone
+def test_tsat_cc_compiled_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(phase, "get_gendir", lambda: str(tmp_path / "missing"))
+
+    gas, mmw = "CH4", 0.01604
+    t = np.linspace(100.0, 200.0, 101)
+    lat = 5.1e5 - 1e3 * (t - 100.0)
+    lp = np.log10(phase.cc_psat(t, gas, mmw, np.array([t, lat])))
+    _write_species(tmp_path, gas, mmw=mmw, lp=lp, lat=lat)
+    _write_species(tmp_path, "O2", mmw=0.032, lat=None)
+    query.set_source(str(tmp_path))
+
+    try:
+        t_true = np.array([111.1, 150.05, 187.3])
+        p = phase.cc_psat(t_true, gas, mmw, np.array([t, lat]))
+        assert np.allclose(query.tsat(p, [gas])[0], t_true, rtol=1e-10)
+
+        # without a latent heat, the table inverse is used
+        v = query.tsat(10**np.array([5.5, 6.5]), ["O2"])[0]
+        assert np.allclose(v, [125.0, 175.0])
+    finally:
+        query.set_source(None)
+
+# Below the lowest temperature of the curve, saturation is not evaluated
+def test_saturation_below_curve(source):
+    t = np.array([50.0, 99.9, 100.0, 150.0])
+    p = np.full(4, 1e7)
+    pp = np.full((1, 4), 2e6)
+    out = query.saturation(t, p, pp, ["Xx"])
+    assert np.all(np.isnan(out["S"][0, :2])) and np.all(np.isnan(out["dx"][0, :2]))
+    assert not np.any(out["mask"][0, :2])
+    assert np.all(out["mask"][0, 2:]) and np.all(out["dx"][0, 2:] > 0)
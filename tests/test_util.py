@@ -0,0 +1,93 @@
+import os
+import threading
+import http.server
+import pytest
+
+from thermotools import util
+
+# Local server for a small set of paths
+#    Each path maps to a list of (status, body) responses, given in turn;
+#    the last is repeated. Other paths return 404. A third item cuts the
+#    response short after that many bytes, and a 206 serves the body from
+#    the start of the requested range.
+class _Handler(http.server.BaseHTTPRequestHandler):
+    routes = {}
+    hits = {}
+    ranges = []
+
+    def do_GET(self):
+        self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        self.ranges.append(self.headers.get("Range"))
+        resp = self.routes.get(self.path, [(404, b"")])
+        status, body, *cut = resp[min(self.hits[self.path], len(resp)) - 1]
+        self.send_response(status)
+        if status == 206:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_header("Content-Range", "bytes %d-%d/%d"%(start, len(body)-1, len(body)))
+            body = body[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if cut:
+            body = body[:cut[0]]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "get_cachedir", lambda: str(tmp_path / "cache"))
+    _Handler.routes = {}
+    _Handler.hits = {}
+    _Handler.ranges = []
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d"%srv.server_address[1]
+    srv.shutdown()
+
+# A transient 5xx in a batch fails that URL only, and is retried next time
+def test_fetch_many_transient(server):
+    _Handler.routes = {
+        "/a.txt" : [(200, b"a")],
+        "/b.txt" : [(503, b""), (200, b"b")],
+        "/c.txt" : [(200, b"c")],
+    }
+    urls = [server + p for p in ("/a.txt", "/b.txt", "/missing.txt", "/c.txt")]
+
+    paths, failed = util.fetch_many(urls, nworkers=4)
+    assert open(paths[0]).read() == "a"
+    assert open(paths[3]).read() == "c"
+    assert paths[1] is None and paths[2] is None
+    assert list(failed) == [urls[1]]
+
+    paths, failed = util.fetch_many(urls, nworkers=4)
+    assert open(paths[1]).read() == "b"
+    assert len(failed) == 0
+
+    # found and missing URLs are cached, only the failure was fetched again
+    assert _Handler.hits == {"/a.txt":1, "/b.txt":2, "/missing.txt":1, "/c.txt":1}
+
+# An interrupted download is resumed from where it stopped, whether or not
+#    the server honours the Range request
+@pytest.mark.parametrize("status", [206, 200])
+def test_fetch_resume(server, tmp_path, status):
+    body = bytes(range(256)) * 4096
+    _Handler.routes = {"/big.bin" : [(200, body, 300000), (status, body)]}
+    url = server + "/big.bin"
+
+    # the chunks received before the cut are kept
+    with pytest.raises(Exception):
+        util.fetch(url, chunk=65536)
+    size = os.path.getsize(util._cache_path(url) + ".part")
+    assert size == 4 * 65536
+
+    fpath = str(tmp_path / "out" / "big.bin")
+    assert util.fetch(url, fpath) == fpath
+    assert open(fpath, "rb").read() == body
+    assert _Handler.ranges == [None, "bytes=%d-"%size]
+
+    # the destination is a copy, unless a link is asked for
+    assert not os.path.samefile(fpath, util._cache_path(url))
+    util.fetch(url, fpath, link=True)
+    assert os.path.samefile(fpath, util._cache_path(url))